@@ -0,0 +1,86 @@
+from semantic_frame import SemanticFrame
+
+
+class ActionTable:
+    """
+    agent actions 的只读索引表
+
+    每个action以 (intent, inform slots 的items, request slots 的items) 的tuple保存，序号与action之间的转换都是O(1)。
+    返回的action是预先生成的SemanticFrame的copy-on-write副本，只有在需要填充slot的value时才会复制slots。
+    """
+
+    def __init__(self, actions):
+        """
+        参数:
+            actions (list): 所有可能的actions，格式为dict('intent': string, 'inform_slots': dict, 'request_slots': dict)
+        """
+
+        self.intents = tuple(action['intent'] for action in actions)
+        self.inform_items = tuple(tuple(action['inform_slots'].items()) for action in actions)
+        self.request_items = tuple(tuple(action['request_slots'].items()) for action in actions)
+        # {(intent, frozenset, frozenset): int}，action到序号的映射
+        self.index = {}
+        for i in range(len(actions)):
+            key = self._key(self.intents[i], self.inform_items[i], self.request_items[i])
+            if key in self.index:
+                raise ValueError('Actions must be unique!')
+            self.index[key] = i
+        # 每个action预先生成的frame，to_action返回它们的副本
+        self.frames = tuple(SemanticFrame(self.intents[i], dict(self.inform_items[i]), dict(self.request_items[i]))
+                            for i in range(len(actions)))
+
+    def __len__(self):
+        return len(self.intents)
+
+    @staticmethod
+    def _key(intent, inform_items, request_items):
+        return intent, frozenset(inform_items), frozenset(request_items)
+
+    def to_index(self, action):
+        """
+        输出action对应的序号
+
+        参数:
+            action (SemanticFrame or dict)
+
+        返回:
+            int
+        """
+
+        key = self._key(action['intent'], action['inform_slots'].items(), action['request_slots'].items())
+        try:
+            return self.index[key]
+        except KeyError:
+            raise ValueError('Response: {} not found in possible actions'.format(action))
+
+    def lookup(self, intent, inform_slot=None, request_slot=None):
+        """
+        输出 (intent, slot) 对应的序号，inform slot的value为PLACEHOLDER，request slot的value为UNK
+
+        参数:
+            intent (string)
+            inform_slot (string)
+            request_slot (string)
+
+        返回:
+            int
+        """
+
+        inform_items = ((inform_slot, 'PLACEHOLDER'),) if inform_slot else ()
+        request_items = ((request_slot, 'UNK'),) if request_slot else ()
+        return self.index[self._key(intent, inform_items, request_items)]
+
+    def to_action(self, index):
+        """
+        生成序号对应的action，每次返回新的frame，slots为copy-on-write
+
+        参数:
+            index (int)
+
+        返回:
+            SemanticFrame
+        """
+
+        if not 0 <= index < len(self.intents):
+            raise ValueError('Index: {} not in range of possible actions'.format(index))
+        return self.frames[index].copy()
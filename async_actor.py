@@ -0,0 +1,117 @@
+from dqn_policy import DQNPolicy
+import queue
+import threading
+
+
+class AsyncActor(threading.Thread):
+    """
+    在后台线程中运行对话的actor，使对话的生成与agent的训练同时进行
+
+    actor用 VecDialogueEnv 以及自己的 DQNPolicy（只用numpy）选择action，将每一步的experience放入有界的队列，
+    每结束train_freq个对话放入一个训练周期的标记。learner（主线程）从队列中取出experience添加到memory，
+    遇到标记时训练，然后用 publish_weights 发布新的参数权重。
+
+    actor最多比learner超前max_staleness个训练周期：为0时actor等待每个周期训练完成，与同步训练相同；
+    为1时actor在learner训练第k个周期的同时生成第k+1个周期的对话。
+    队列已满时actor等待learner，memory以及Keras模型只在learner中使用，DB查询缓存只在actor中使用。
+    """
+
+    def __init__(self, env, constants, num_episodes, train_freq, max_queue_size, max_staleness):
+        """
+        参数:
+            env (VecDialogueEnv): actor运行的对话
+            constants (dict): 配置参数
+            num_episodes (int): 一共需要结束的对话数目
+            train_freq (int): 每个训练周期的对话数目
+            max_queue_size (int): 队列中最多的消息数目
+            max_staleness (int): actor最多比learner超前的训练周期数目
+        """
+
+        super().__init__(daemon=True)
+        self.env = env
+        self.policy = DQNPolicy(env.get_state_size(), constants)
+        self.num_episodes = num_episodes
+        self.train_freq = train_freq
+        self.max_staleness = max_staleness
+        self.queue = queue.Queue(max_queue_size)
+
+        self.condition = threading.Condition()
+        # learner发布的参数权重以及已经训练完成的周期数目
+        self.weights = None
+        self.learner_period = 0
+        self.stopped = False
+
+    def publish_weights(self, weights, period):
+        """
+        由learner调用，发布训练完第period个周期之后的参数权重
+
+        参数:
+            weights (list): behavior model的参数权重
+            period (int): 已经训练完成的周期数目
+        """
+
+        with self.condition:
+            self.weights = weights
+            self.learner_period = period
+            self.condition.notify_all()
+
+    def stop(self):
+        """让actor尽快结束"""
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def get(self):
+        """
+        由learner调用，取出队列中的下一个消息
+
+        返回:
+            string: 'experiences'，'period'，'done' 或者 'error'
+            tuple: 'experiences' 为 (states, actions, rewards, next_states, dones)；
+                   'period' 为 (episode, period_success_total, period_reward_total)；'done' 为None；
+                   'error' 为actor中发生的exception
+        """
+
+        return self.queue.get()
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            # 交给learner处理，否则learner会一直等待
+            self.queue.put(('error', e))
+
+    def _run(self):
+        episode = 0
+        period = 0
+        period_success_total = 0
+        period_reward_total = 0.0
+        states = self.env.reset()
+        while episode < self.num_episodes:
+            with self.condition:
+                while period - self.learner_period > self.max_staleness and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                self.policy.set_weights(self.weights)
+
+            actions = self.policy.get_actions(states)
+            next_states, rewards, dones, successes = self.env.step(actions)
+            self.queue.put(('experiences', (states, actions, rewards, next_states, dones)))
+            period_reward_total += float(rewards.sum())
+            states = self.env.states
+
+            for success in successes[dones]:
+                episode += 1
+                period_success_total += int(success)
+                if episode % self.train_freq == 0:
+                    # DB查询缓存只在actor中使用，在这里保存（如果设置了cache file）
+                    self.env.db_helper.save_cache()
+                    self.queue.put(('period', (episode, period_success_total, period_reward_total)))
+                    period += 1
+                    period_success_total = 0
+                    period_reward_total = 0.0
+                if episode == self.num_episodes:
+                    break
+        self.queue.put(('done', None))
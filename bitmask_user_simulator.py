@@ -0,0 +1,386 @@
+from dialogue_config import FAIL, NO_OUTCOME, SUCCESS
+from user_simulator import UserSimulator
+from utils import reward_function, convert_list_to_dict
+from semantic_frame import SemanticFrame
+import random
+
+
+def _bits(mask):
+    """按从小到大的顺序返回mask中为1的位（slot编号）"""
+
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return ids
+
+
+class BitmaskUserSimulator(UserSimulator):
+    """
+    与 UserSimulator 的对话行为（包括随机数的使用）完全相同，但state以位掩码保存
+
+    history/inform/request/rest slots 各是一个整数，第i位表示编号为i的slot（编号见 self.slots，开始时与 GoalTable.slots
+    相同，之后遇到的新slot由user sim.自己编号，不会修改共享的goal table）是否存在，values保存在以slot编号为下标的list中。
+    清空、删除以及每一步最后的检查都是位运算。
+    rest slots的values在一个episode中不变（goal中的value或者 'UNK'），由goal得到。
+    用 usersim_equivalence.py 检查两者的结果是否相同。
+    """
+
+    def __init__(self, goal_list, constants, database):
+        """
+        参数:
+            goal_list (list): 用户目的样例，从文件中加载；也可以是 GoalTable 或者 GoalCorpus
+            constants (dict): 配置
+            database (dict): 数据库，dict形式
+        """
+
+        super().__init__(goal_list, constants, database)
+        # 自己的slot编号（复制goal table的编号），goal table 被多个user sim.共享，不能修改
+        self.slots = list(self.goal_table.slots)
+        self.slot_ids = convert_list_to_dict(self.slots)
+        self.history_values, self.inform_values, self.goal_values, self.rest_values = [], [], [], []
+        self.default_id = self._slot_id(self.default_key)
+        self.no_query_mask = 0
+        for key in self.no_query:
+            self.no_query_mask |= 1 << self._slot_id(key)
+
+    def _slot_id(self, slot):
+        """slot的编号，新的slot加在self.slots的最后，并扩大values的list"""
+
+        slot_id = self.slot_ids.get(slot)
+        if slot_id is None:
+            slot_id = self.slot_ids[slot] = len(self.slots)
+            self.slots.append(slot)
+        if slot_id >= len(self.history_values):
+            grow = [None] * (slot_id + 1 - len(self.history_values))
+            for values in (self.history_values, self.inform_values, self.goal_values, self.rest_values):
+                values.extend(grow)
+        return slot_id
+
+    def reset(self):
+        """
+        重置user sim. 清空state以及初始化action.
+
+        返回:
+            SemanticFrame: initial action
+        """
+
+        # 随机选择用户目的 user goal（预编译的，只读）
+        self.goal = goal = self.goal_table.sample()
+        # goal的inform slots以及request slots（包括default slot）的编号
+        inform_ids = [self._slot_id(key) for key, _ in goal.inform_items]
+        request_ids = [self._slot_id(key) for key in goal.request_slots]
+        num_slots = len(self.slots)
+        self.history_mask = 0
+        self.history_values = [None] * num_slots
+        self.inform_mask = 0
+        self.inform_values = [None] * num_slots
+        self.request_mask = 0
+        self.goal_values = [None] * num_slots
+        self.rest_values = [None] * num_slots
+
+        self.goal_inform_mask = 0
+        for slot_id, (_, value) in zip(inform_ids, goal.inform_items):
+            self.goal_inform_mask |= 1 << slot_id
+            self.goal_values[slot_id] = value
+        self.goal_request_mask = 0
+        for slot_id in request_ids:
+            self.goal_request_mask |= 1 << slot_id
+        # rest slots的顺序与 UserSimulator 中的dict相同，用于随机选择
+        self.rest_mask = self.goal_inform_mask | self.goal_request_mask
+        self.rest_order = []
+        for key, value in goal.rest_slots:
+            slot_id = self.slot_ids[key]
+            self.rest_order.append(slot_id)
+            self.rest_values[slot_id] = value
+        # 只在goal的inform slots中检查的slots，按goal的顺序
+        self.query_informs = [(key, value) for slot_id, (key, value) in zip(inform_ids, goal.inform_items)
+                              if not (self.no_query_mask >> slot_id) & 1]
+
+        self.intent = ''
+        # False for failure, true for success, 初始化为FAIL
+        self.constraint_check = FAIL
+
+        return self._return_init_action()
+
+    @property
+    def state(self):
+        """与 UserSimulator.state 格式相同的dict（每次新建），用于调试以及 usersim_equivalence.py"""
+
+        return {'history_slots': {self.slots[i]: self.history_values[i] for i in _bits(self.history_mask)},
+                'inform_slots': {self.slots[i]: self.inform_values[i] for i in _bits(self.inform_mask)},
+                'request_slots': {self.slots[i]: 'UNK' for i in _bits(self.request_mask)},
+                'rest_slots': {self.slots[i]: self.rest_values[i] for i in self._rest_ids()},
+                'intent': self.intent}
+
+    def _rest_ids(self):
+        """按顺序返回rest slots中的slot编号"""
+
+        rest_mask = self.rest_mask
+        return [slot_id for slot_id in self.rest_order if (rest_mask >> slot_id) & 1]
+
+    def _inform(self, slot_id, value):
+        """user inform value：加入inform slots以及history slots，从rest slots中删除"""
+
+        self.inform_mask |= 1 << slot_id
+        self.inform_values[slot_id] = value
+        self.history_mask |= 1 << slot_id
+        self.history_values[slot_id] = value
+        self.rest_mask &= ~(1 << slot_id)
+
+    def _return_init_action(self):
+        """
+        Returns the initial action of the episode.
+
+        The initial action has an intent of request, required init. inform slots and a single request slot.
+
+        返回:
+            SemanticFrame: Initial user response
+        """
+
+        self.intent = 'request'
+        init_informs = ()
+        if self.goal.inform_slots:
+            init_informs = self.goal.init_informs
+            if not init_informs:
+                init_informs = [random.choice(self.goal.inform_items)]
+            for key, value in init_informs:
+                self._inform(self._slot_id(key), value)
+
+        if self.goal.request_candidates:
+            req_key = random.choice(self.goal.request_candidates)
+        else:
+            req_key = self.default_key
+        self.request_mask = 1 << self._slot_id(req_key)
+
+        # 保持init. informs的顺序
+        return SemanticFrame(self.intent, dict(init_informs), {req_key: 'UNK'})
+
+    def step(self, agent_action):
+        """
+        返回user sim. 的回答，规则与 UserSimulator.step 相同
+
+        Parameters:
+            agent_action (SemanticFrame): agent 行为
+
+        Returns:
+            SemanticFrame: User sim. response
+            int: Reward
+            bool: Done flag
+            int: Success: -1, 0 or 1 for loss, neither win nor loss, win
+        """
+
+        for value in agent_action.inform_slots.values():
+            assert value != 'UNK'
+            assert value != 'PLACEHOLDER'
+        for value in agent_action.request_slots.values():
+            assert value != 'PLACEHOLDER'
+
+        self.inform_mask = 0
+        self.intent = ''
+
+        done = False
+        success = NO_OUTCOME
+        if agent_action.round == self.max_round:
+            done = True
+            success = FAIL
+            self.intent = 'done'
+            self.request_mask = 0
+        else:
+            agent_intent = agent_action.intent
+            if agent_intent == 'request':
+                self._response_to_request(agent_action)
+            elif agent_intent == 'inform':
+                self._response_to_inform(agent_action)
+            elif agent_intent == 'match_found':
+                self._response_to_match_found(agent_action)
+            elif agent_intent == 'done':
+                success = self._response_to_done()
+                self.intent = 'done'
+                self.request_mask = 0
+                done = True
+
+        # Assumptions (bit ops) -------
+        if self.intent == 'request':
+            assert self.request_mask
+        if self.intent == 'inform':
+            assert self.inform_mask
+            assert not self.request_mask
+        # request slots的value总是'UNK'，inform slots最多只有一项
+        for slot_id in _bits(self.inform_mask):
+            assert self.inform_values[slot_id] != 'UNK'
+        goal_mask = self.goal_inform_mask | self.goal_request_mask
+        # No overlap between rest and hist
+        assert not self.rest_mask & self.history_mask
+        # All slots in both rest and hist should contain the slots for goal
+        assert not goal_mask & ~(self.history_mask | self.rest_mask)
+        # Anything in the rest should be in the goal
+        assert not self.rest_mask & ~goal_mask
+        assert self.intent != ''
+        # -----------------------
+
+        user_response = self._state_to_frame()
+
+        reward = reward_function(success, self.max_round)
+
+        return user_response, reward, done, success == SUCCESS
+
+    def _state_to_frame(self):
+        """
+        用当前state生成user response（inform slots以及request slots最多各有一项，按编号的顺序即可）
+
+        Returns:
+            SemanticFrame
+        """
+
+        return SemanticFrame(self.intent, {self.slots[i]: self.inform_values[i] for i in _bits(self.inform_mask)},
+                             {self.slots[i]: 'UNK' for i in _bits(self.request_mask)})
+
+    def _response_to_request(self, agent_action):
+        """
+        Augments the state in response to the agent action having an intent of request, see
+        UserSimulator._response_to_request.
+
+        Parameters:
+            agent_action (SemanticFrame): Intent of request
+        """
+
+        agent_request_key = list(agent_action.request_slots.keys())[0]
+        slot_id = self._slot_id(agent_request_key)
+        bit = 1 << slot_id
+        # First Case: inform the goal value
+        if self.goal_inform_mask & bit:
+            self.intent = 'inform'
+            self._inform(slot_id, self.goal_values[slot_id])
+            self.request_mask = 0
+        # Second Case: goal request slot that has already been informed, inform it again
+        elif self.goal_request_mask & bit and self.history_mask & bit:
+            self.intent = 'inform'
+            self.inform_mask |= bit
+            self.inform_values[slot_id] = self.history_values[slot_id]
+            self.request_mask = 0
+            assert not self.rest_mask & bit
+        # Third Case: goal request slot that HASN'T been informed, request it with a random inform
+        elif self.goal_request_mask & bit and self.rest_mask & bit:
+            self.request_mask = bit
+            self.intent = 'request'
+            rest_informs = [i for i in self._rest_ids() if self.rest_values[i] != 'UNK']
+            if rest_informs:
+                key_id = random.choice(rest_informs)
+                self._inform(key_id, self.rest_values[key_id])
+        # Fourth and Final Case: inform 'anything'
+        else:
+            assert not self.rest_mask & bit
+            self.intent = 'inform'
+            self.inform_mask |= bit
+            self.inform_values[slot_id] = 'anything'
+            self.request_mask = 0
+            self.history_mask |= bit
+            self.history_values[slot_id] = 'anything'
+
+    def _response_to_inform(self, agent_action):
+        """
+        Augments the state in response to the agent action having an intent of inform, see
+        UserSimulator._response_to_inform.
+
+        Parameters:
+            agent_action (SemanticFrame): Intent of inform
+        """
+
+        agent_inform_key = list(agent_action.inform_slots.keys())[0]
+        agent_inform_value = agent_action.inform_slots[agent_inform_key]
+
+        assert agent_inform_key != self.default_key
+
+        slot_id = self._slot_id(agent_inform_key)
+        bit = 1 << slot_id
+        self.history_mask |= bit
+        self.history_values[slot_id] = agent_inform_value
+        self.rest_mask &= ~bit
+        self.request_mask &= ~bit
+
+        # First Case: the informed value doesnt match the goal, inform the correct value
+        if self.goal_inform_mask & bit and agent_inform_value != self.goal_values[slot_id]:
+            self.intent = 'inform'
+            self._inform(slot_id, self.goal_values[slot_id])
+            self.request_mask = 0
+        # Second Case: Otherwise pick a random action to take
+        else:
+            if self.request_mask:
+                self.intent = 'request'
+            elif self.rest_mask:
+                # default slot不参与随机选择（它的value总是'UNK'，之后仍在rest slots中）
+                rest_ids = [i for i in self._rest_ids() if i != self.default_id]
+                if rest_ids:
+                    key_id = random.choice(rest_ids)
+                    value = self.rest_values[key_id]
+                    if value != 'UNK':
+                        self.intent = 'inform'
+                        self._inform(key_id, value)
+                    else:
+                        self.intent = 'request'
+                        self.request_mask |= 1 << key_id
+                else:
+                    self.intent = 'request'
+                    self.request_mask |= 1 << self.default_id
+            else:
+                self.intent = 'thanks'
+
+    def _response_to_match_found(self, agent_action):
+        """
+        Augments the state in response to the agent action having an intent of match_found, see
+        UserSimulator._response_to_match_found.
+
+        Parameters:
+            agent_action (SemanticFrame): Intent of match_found
+        """
+
+        agent_informs = agent_action.inform_slots
+
+        self.intent = 'thanks'
+        self.constraint_check = SUCCESS
+
+        assert self.default_key in agent_informs
+        default_bit = 1 << self.default_id
+        self.rest_mask &= ~default_bit
+        self.history_mask |= default_bit
+        self.history_values[self.default_id] = str(agent_informs[self.default_key])
+        self.request_mask &= ~default_bit
+
+        if agent_informs[self.default_key] == 'no match available':
+            self.constraint_check = FAIL
+
+        for key, value in self.query_informs:
+            if value != agent_informs.get(key, None):
+                self.constraint_check = FAIL
+                break
+
+        if self.constraint_check == FAIL:
+            self.intent = 'reject'
+            self.request_mask = 0
+
+    def _response_to_done(self):
+        """
+        Augments the state in response to the agent action having an intent of done, see
+        UserSimulator._response_to_done.
+
+        返回:
+            int: Success: -1, 0 or 1 for loss, neither win nor loss, win
+        """
+
+        if self.constraint_check == FAIL:
+            return FAIL
+
+        if self.rest_mask:
+            return FAIL
+        assert not self.request_mask
+
+        ticket = self.history_values[self.default_id]
+        assert ticket != 'no match available'
+
+        match = self.database[int(ticket)]
+        for key, value in self.query_informs:
+            assert value == match.get(key, None), 'match: {}\ngoal: {}'.format(match, self.goal)
+
+        return SUCCESS
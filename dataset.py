@@ -0,0 +1,191 @@
+from db_query import DBQuery
+from db_tables import tables_nbytes, write_tables, read_tables
+from utils import remove_empty_slots, intern_slot_values
+import numpy as np
+import pickle, argparse, json, hashlib, struct, mmap, os
+
+# 编译后的数据文件的格式版本，格式改变时加1，旧的文件需要重新编译
+DATASET_VERSION = 2
+_MAGIC = b'GOBOTDS\x00'
+# 文件头：magic、格式版本、数据区的字节数以及sha256，数据区从DATA_OFFSET开始（与db_tables的对齐方式相同）
+_FILE_HEADER = struct.Struct('<8sI4xQ32s')
+DATA_OFFSET = 64
+
+
+def load_pickle(path):
+    """
+    加载原始的pickle文件，行尾被转换为'\\r\\n'的文件（见 pickle_converter.py）在内存中转换后再加载
+
+    参数:
+        path (string)
+
+    返回:
+        object
+    """
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    try:
+        return pickle.loads(content, encoding='latin1')
+    except pickle.UnpicklingError:
+        return pickle.loads(b''.join(line + b'\n' for line in content.splitlines()), encoding='latin1')
+
+
+def _goals_to_tables(user_goals):
+    """
+    将user goals编码为arrays：每个goal的slots在goal_slots中的范围为goal_offsets[i]:goal_offsets[i + 1]，
+    每一行为 (0为inform/1为request, slot编号, value编号)
+
+    返回:
+        dict: {string: numpy.array}
+        dict: meta，包括slots, values, diaacts
+    """
+
+    slots, values = {}, {}
+    offsets, rows, diaacts = [0], [], []
+    for goal in user_goals:
+        for kind, key in enumerate(('inform_slots', 'request_slots')):
+            for slot, value in goal[key].items():
+                rows.append((kind, slots.setdefault(slot, len(slots)), values.setdefault(value, len(values))))
+        offsets.append(len(rows))
+        diaacts.append(goal.get('diaact'))
+    arrays = {'goal_offsets': np.array(offsets, dtype=np.int64),
+              'goal_slots': np.array(rows, dtype=np.int32).reshape(-1, 3)}
+    meta = {'slots': list(slots), 'values': list(values), 'diaacts': diaacts}
+    return arrays, meta
+
+
+def _goals_from_tables(arrays, meta):
+    """由_goals_to_tables的结果还原user goals，每次返回新的dicts"""
+
+    slots, values = meta['slots'], meta['values']
+    offsets = arrays['goal_offsets'].tolist()
+    rows = arrays['goal_slots'].tolist()
+    user_goals = []
+    for i, diaact in enumerate(meta['diaacts']):
+        goal = {'request_slots': {}, 'inform_slots': {}}
+        if diaact is not None:
+            goal['diaact'] = diaact
+        for kind, slot, value in rows[offsets[i]:offsets[i + 1]]:
+            goal['request_slots' if kind else 'inform_slots'][slots[slot]] = values[value]
+        user_goals.append(goal)
+    return user_goals
+
+
+def compile_dataset(constants, path):
+    """
+    将db_file_paths中的db、movie dict以及user goals编译为一个文件
+
+    文件中包括清理后的db、词表、倒排索引以及编码列（DBQuery.to_tables），movie dict，以及编码后的user goals，
+    开头为格式版本、数据区的字节数以及sha256。
+
+    参数:
+        constants (dict): 配置参数
+        path (string): 输出的文件
+
+    返回:
+        int: 文件的字节数
+    """
+
+    file_path_dict = constants['db_file_paths']
+    database = load_pickle(file_path_dict['database'])
+    remove_empty_slots(database)
+    intern_slot_values(database)
+    db_dict = load_pickle(file_path_dict['dict'])
+    user_goals = load_pickle(file_path_dict['user_goals'])
+
+    db_arrays, db_meta = DBQuery(database, constants).to_tables()
+    goal_arrays, goal_meta = _goals_to_tables(user_goals)
+    arrays = {'db/' + name: array for name, array in db_arrays.items()}
+    arrays.update({'goals/' + name: array for name, array in goal_arrays.items()})
+    meta = {'db': db_meta, 'goals': goal_meta, 'dict': {slot: list(values) for slot, values in db_dict.items()}}
+
+    buf = bytearray(DATA_OFFSET + tables_nbytes(arrays, meta))
+    data = memoryview(buf)[DATA_OFFSET:]
+    write_tables(data, arrays, meta)
+    _FILE_HEADER.pack_into(buf, 0, _MAGIC, DATASET_VERSION, len(data), hashlib.sha256(data).digest())
+    data.release()
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(buf)
+    os.replace(tmp_path, path)
+    return len(buf)
+
+
+class Dataset:
+    """
+    内存映射的编译后的数据文件
+
+    db直接使用文件中的词表、索引以及编码列（只读，不复制），条目以及user goals在被访问时才还原。
+    加载时只检查文件头（magic、格式版本以及数据区的字节数），数据区的sha256需要读取整个文件，只在verify时检查。
+    """
+
+    def __init__(self, path, constants, verify=False):
+        """
+        参数:
+            path (string): compile_dataset 输出的文件
+            constants (dict): 配置参数
+            verify (bool): 是否检查数据区的sha256（读取整个文件，抵消内存映射按需加载的好处）
+        """
+
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < DATA_OFFSET:
+            raise ValueError('{} is not a compiled dataset!'.format(path))
+        magic, version, data_size, digest = _FILE_HEADER.unpack_from(self.mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError('{} is not a compiled dataset!'.format(path))
+        if version != DATASET_VERSION:
+            raise ValueError('Dataset {} has version {}, expected {}. Compile it again with dataset.py'
+                             .format(path, version, DATASET_VERSION))
+        data = memoryview(self.mmap)[DATA_OFFSET:]
+        if len(data) != data_size:
+            raise ValueError('Dataset {} is truncated ({} of {} bytes). Compile it again with dataset.py'
+                             .format(path, len(data), data_size))
+        if verify and hashlib.sha256(data).digest() != digest:
+            raise ValueError('Dataset {} is corrupted (checksum mismatch). Compile it again with dataset.py'
+                             .format(path))
+
+        arrays, meta = read_tables(data)
+        self._goal_arrays = {name[len('goals/'):]: array for name, array in arrays.items()
+                             if name.startswith('goals/')}
+        self._goal_meta = meta['goals']
+        db_arrays = {name[len('db/'):]: array for name, array in arrays.items() if name.startswith('db/')}
+        self.db_helper = DBQuery.from_tables(db_arrays, meta['db'], constants)
+        # 保留对内存映射的引用，避免被回收
+        self.db_helper.dataset = self
+        self.database = self.db_helper.database
+        self.db_dict = meta['dict']
+        self._user_goals = None
+
+    @property
+    def user_goals(self):
+        """user goals，list of dict"""
+
+        if self._user_goals is None:
+            self._user_goals = _goals_from_tables(self._goal_arrays, self._goal_meta)
+        return self._user_goals
+
+
+if __name__ == "__main__":
+    # Compiles the movie DB, movie dict and user goals of 'db_file_paths' into one file
+    # 1) In terminal: python dataset.py --constants_path "constants.json" --output "data/movie_dataset.bin"
+    # 2) Set "dataset" under db_file_paths in the constants of train.py/test.py to the output path
+    # Loading only checks the header, check the sha256 of a compiled file with: python dataset.py --verify
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--constants_path', dest='constants_path', type=str, default='constants.json')
+    parser.add_argument('--output', dest='output', type=str, default='')
+    parser.add_argument('--verify', dest='verify', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.constants_path) as f:
+        constants = json.load(f)
+
+    output = args.output or constants['db_file_paths']['dataset'] or 'data/movie_dataset.bin'
+    if args.verify:
+        Dataset(output, constants, verify=True)
+        print('Verified dataset: {}'.format(output))
+    else:
+        nbytes = compile_dataset(constants, output)
+        print('Compiled dataset: {} ({} bytes, version {})'.format(output, nbytes, DATASET_VERSION))
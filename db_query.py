@@ -1,26 +1,460 @@
 from collections import defaultdict
 from dialogue_config import no_query_keys, usersim_default_key
-import copy
+from query_cache import QueryCache
+from db_tables import TableRows
+from utils import build_value_vocab, normalize_slot_value
+import numpy as np
+import pickle, hashlib, atexit, json, os, warnings
+
+
+# 列式存储中表示条目没有这个slot的编码
+MISSING_CODE = -1
+# value不在词表中（即db中不存在）时所用的编码，不会与任何条目匹配
+UNKNOWN_CODE = -2
+# 没有满足条件的条目时的查询结果，所有空结果共用这一个只读的array
+NO_ROWS = np.empty(0, dtype=np.int64)
+NO_ROWS.flags.writeable = False
+# 持久化查询缓存文件的格式版本，格式改变时增加
+CACHE_FILE_VERSION = 1
+# 每个进程中负责加载、保存持久化查询缓存的DBQuery，{cache_file_path: DBQuery}
+_cache_owners = {}
+# 已经注册了 _save_caches 的进程
+_saver_pid = None
+
+
+def _save_caches():
+    """进程退出时保存本进程中所有的持久化查询缓存（fork出的子进程继承的不保存）"""
+
+    for db_helper in list(_cache_owners.values()):
+        if db_helper._cache_pid == os.getpid():
+            db_helper.save_cache()
 
 
 class DBQuery:
     """查询数据库，为状态追踪器（state tracker）提供信息"""
 
-    def __init__(self, database):
+    def __init__(self, database, constants):
         """
-        参数：以dict方式存储的关于电影信息的database
+        参数：
+            database (dict): 以dict方式存储的关于电影信息的database
+            constants (dict): 配置参数
         """
 
+        self._init_query(constants)
         self.database = database
-        # {frozenset: {string: int}} A dict of dicts
-        self.cached_db_slot = defaultdict(dict)
-        # {frozenset: {'#': {'slot': 'value'}}} A dict of dicts of dicts, a dict of DB sub-dicts
-        self.cached_db = defaultdict(dict)
+        # db中所有条目的id，按db原有顺序排列，倒排索引中存储的是条目在此list中的位置
+        self.row_ids = list(self.database.keys())
+        # db中所有value的词表，value统一为小写，values为按编码排列的value，vocab为value（包括db中的原始写法）到编码的映射
+        self.values, self.vocab = build_value_vocab(self.database)
+        # 倒排索引 {slot: {value code: numpy.array}}，value为按顺序排列的条目位置
+        self.index = self._build_index()
+        # db中出现过的所有slot
+        self.slots = list(self.index.keys())
+        # 没有任何约束条件时的查询结果，即db中所有条目的位置
+        self.all_rows = np.arange(len(self.row_ids))
+        self.all_rows.flags.writeable = False
+        # {slot: numpy.array}，每个slot一列，存储每个条目value在词表中的编码，缺失的slot为MISSING_CODE
+        self.columns = self._build_columns()
+        # {slot: list}，每个slot区分大小写的原始value，按在db中第一次出现的顺序排列
+        # {slot: numpy.array}，每个slot一列，存储每个条目原始value在raw_values中的位置，缺失的slot为MISSING_CODE
+        self.raw_values, self.raw_columns = self._build_raw_columns()
+        self._init_cache_file()
+
+    def _init_query(self, constants):
+        """初始化与db内容无关的查询设置以及缓存"""
+
+        # 有大小上限的LRU缓存，{frozenset: {string: int}}
+        self.cached_db_slot = QueryCache(constants['db']['cache_size'])
+        # 有大小上限的LRU缓存，{frozenset: numpy.array}，value为满足约束条件的条目位置，没有满足条件的条目时为NO_ROWS
+        self.cached_db = QueryCache(constants['db']['cache_size'])
         # 不需要查询的keys
         self.no_query = no_query_keys
         self.match_key = usersim_default_key
+        # 是否使用列式存储来缩小候选条目以及填充inform slot
+        self.columnar = constants['db']['columnar']
+        # 持久化查询缓存的文件路径，为空时不使用
+        self.cache_file_path = constants['db']['cache_file_path']
+
+    def _init_cache_file(self):
+        """
+        如果设置了cache_file_path，则从文件加载查询缓存，并在进程退出时保存
+
+        每个进程中每个缓存文件只由第一个DBQuery加载（只计算一次fingerprint），之后同一个db的DBQuery共用它的查询缓存，
+        进程退出时统一保存一次。db不能计算fingerprint（条目id不是整数）时不使用缓存文件。
+        """
+
+        global _saver_pid
+        if not self.cache_file_path:
+            return
+        owner = _cache_owners.get(self.cache_file_path)
+        if owner is not None and owner._cache_pid == os.getpid():
+            if owner._same_db(self):
+                self.cached_db, self.cached_db_slot = owner.cached_db, owner.cached_db_slot
+                self._fingerprint = owner._fingerprint
+            else:
+                warnings.warn('Query cache file {} is already used by another database in this process, '
+                              'not using it.'.format(self.cache_file_path))
+                self.cache_file_path = ''
+            return
+        try:
+            self.load_cache()
+        except ValueError as e:
+            warnings.warn('Query cache file {} disabled: {}'.format(self.cache_file_path, e))
+            self.cache_file_path = ''
+            return
+        self._cache_pid = os.getpid()
+        _cache_owners[self.cache_file_path] = self
+        if _saver_pid != os.getpid():
+            atexit.register(_save_caches)
+            _saver_pid = os.getpid()
+
+    def detach_cache_file(self):
+        """
+        进程退出时不保存这个DBQuery的缓存文件（例如worker进程，由learner保存它发回的缓存条目）
+
+        同一个进程中共用这个缓存文件的DBQuery都不再保存，cache_entries 仍然可以使用。
+        """
+
+        owner = _cache_owners.get(self.cache_file_path)
+        if owner is not None and owner._cache_pid == os.getpid():
+            del _cache_owners[self.cache_file_path]
+
+    def _same_db(self, other):
+        """other是否与这个DBQuery的db内容相同（条目位置可以共用查询缓存）"""
+
+        return (len(self.row_ids) == len(other.row_ids) and self.slots == other.slots and
+                self.values == other.values and
+                all(np.array_equal(self.columns[slot], other.columns[slot]) for slot in self.slots))
+
+    def to_tables(self):
+        """
+        将db、词表、倒排索引以及编码列转换为一组numpy array以及可以用json保存的字符串，用于共享内存或者保存到文件
+
+        倒排索引以CSR的形式保存：posting_keys的每一行为 (slot的位置, value code)，对应的条目位置为
+        posting_rows[posting_offsets[i]:posting_offsets[i + 1]]。
+
+        返回:
+            dict: {string: numpy.array}
+            dict: meta，包括slots, values, raw_values
+        """
+
+        try:
+            row_ids = np.array(self.row_ids, dtype=np.int64)
+        except (TypeError, ValueError):
+            raise ValueError('Only databases with integer ids can be converted to tables!')
+        posting_keys, posting_lengths, postings = [], [], []
+        for i, slot in enumerate(self.slots):
+            for code, rows in self.index[slot].items():
+                posting_keys.append((i, code))
+                posting_lengths.append(len(rows))
+                postings.append(rows)
+        arrays = {
+            'row_ids': row_ids,
+            'columns': np.array([self.columns[slot] for slot in self.slots], dtype=np.int32),
+            'raw_columns': np.array([self.raw_columns[slot] for slot in self.slots], dtype=np.int32),
+            'posting_keys': np.array(posting_keys, dtype=np.int32).reshape(-1, 2),
+            'posting_offsets': np.concatenate([[0], np.cumsum(posting_lengths)]).astype(np.int64),
+            'posting_rows': np.concatenate(postings).astype(np.int64) if postings else NO_ROWS,
+        }
+        meta = {'slots': self.slots, 'values': self.values,
+                'raw_values': [self.raw_values[slot] for slot in self.slots]}
+        return arrays, meta
+
+    @classmethod
+    def from_tables(cls, arrays, meta, constants):
+        """
+        由to_tables的结果创建DBQuery，直接使用arrays（例如共享内存上的view）而不复制数据
+
+        database为TableRows，条目在被访问时才从编码列中还原。
+
+        参数:
+            arrays (dict): {string: numpy.array}
+            meta (dict)
+            constants (dict): 配置参数
+
+        返回:
+            DBQuery
+        """
+
+        db_helper = cls.__new__(cls)
+        db_helper._init_query(constants)
+        db_helper.slots = meta['slots']
+        db_helper.values = meta['values']
+        db_helper.vocab = {value: code for code, value in enumerate(db_helper.values)}
+        for raw_values in meta['raw_values']:
+            for value in raw_values:
+                db_helper.vocab.setdefault(value, db_helper.vocab[normalize_slot_value(value)])
+        db_helper.database = TableRows(arrays['row_ids'], db_helper.slots, meta['raw_values'], arrays['raw_columns'])
+        db_helper.row_ids = arrays['row_ids']
+        db_helper.all_rows = np.arange(len(db_helper.row_ids))
+        db_helper.all_rows.flags.writeable = False
+        db_helper.columns = dict(zip(db_helper.slots, arrays['columns']))
+        db_helper.raw_values = dict(zip(db_helper.slots, meta['raw_values']))
+        db_helper.raw_columns = dict(zip(db_helper.slots, arrays['raw_columns']))
+        db_helper.index = {slot: {} for slot in db_helper.slots}
+        offsets = arrays['posting_offsets']
+        for i, (slot_index, code) in enumerate(arrays['posting_keys'].tolist()):
+            db_helper.index[db_helper.slots[slot_index]][code] = arrays['posting_rows'][offsets[i]:offsets[i + 1]]
+        db_helper._init_cache_file()
+        return db_helper
+
+    def fingerprint(self):
+        """
+        返回db内容的hash，用于判断持久化的查询缓存是否仍然有效
+
+        返回:
+            string
+        """
+
+        arrays, meta = self.to_tables()
+        digest = hashlib.sha256(json.dumps(meta, sort_keys=True).encode('utf-8'))
+        for name in sorted(arrays):
+            digest.update(name.encode('utf-8'))
+            digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+        return digest.hexdigest()
+
+    def load_cache(self):
+        """
+        从cache_file_path加载查询缓存
+
+        文件不存在、格式版本不同或者db的内容已经改变（fingerprint不同）时不加载，文件损坏（无法读取）时给出警告，
+        以空的缓存开始。之后保存时会覆盖这个文件。db不能计算fingerprint时抛出ValueError。
+        """
+
+        self._fingerprint = self.fingerprint()
+        if not os.path.exists(self.cache_file_path):
+            return
+        try:
+            with open(self.cache_file_path, 'rb') as f:
+                cache_file = pickle.load(f)
+            if cache_file['version'] != CACHE_FILE_VERSION or cache_file['fingerprint'] != self._fingerprint:
+                return
+            self.merge_cache_entries(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError, ValueError) as e:
+            warnings.warn('Query cache file {} could not be read ({!r}), starting with an empty cache.'.format(
+                self.cache_file_path, e))
+            self.cached_db.clear()
+            self.cached_db_slot.clear()
+
+    def cache_entries(self, skip=None):
+        """
+        返回查询缓存的条目（可以pickle），用于保存到文件或者由worker进程发送给learner
+
+        参数:
+            skip (dict): 可选，{'db': set, 'db_slot': set}，其中的key不返回，返回的key会被加入其中
+
+        返回:
+            dict: {'db': list, 'db_slot': list}，条目位置以int32的bytes保存
+        """
 
-    def fill_inform_slot(self, inform_slot_to_fill, current_inform_slots):
+        entries = {}
+        for name, cache in (('db', self.cached_db), ('db_slot', self.cached_db_slot)):
+            items = cache.items()
+            if skip is not None:
+                items = [(key, value) for key, value in items if key not in skip[name]]
+                skip[name].update(key for key, _ in items)
+            if name == 'db':
+                items = [(tuple(key), rows.astype(np.int32).tobytes()) for key, rows in items]
+            else:
+                items = [(tuple(key), counts) for key, counts in items]
+            entries[name] = items
+        return entries
+
+    def merge_cache_entries(self, entries):
+        """
+        将 cache_entries 的结果加入查询缓存
+
+        参数:
+            entries (dict): {'db': list, 'db_slot': list}
+        """
+
+        for items, rows in entries['db']:
+            rows = np.frombuffer(rows, dtype=np.int32).astype(np.int64) if rows else NO_ROWS
+            rows.flags.writeable = False
+            self.cached_db.put(frozenset(items), rows)
+        for items, counts in entries['db_slot']:
+            self.cached_db_slot.put(frozenset(items), counts)
+
+    def save_cache(self):
+        """
+        将查询缓存保存到cache_file_path
+
+        条目位置以int32的bytes保存，先写入临时文件再替换，避免进程中断时留下不完整的文件。
+        """
+
+        if not self.cache_file_path:
+            return
+        cache_file = {'version': CACHE_FILE_VERSION, 'fingerprint': self._fingerprint}
+        cache_file.update(self.cache_entries())
+        # 临时文件的名字包括进程id，多个进程同时保存时不会互相覆盖临时文件
+        tmp_file_path = '{}.{}.tmp'.format(self.cache_file_path, os.getpid())
+        with open(tmp_file_path, 'wb') as f:
+            pickle.dump(cache_file, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file_path, self.cache_file_path)
+
+    def _build_index(self):
+        """
+        建立 (slot, value) 到db条目位置的倒排索引，value为词表中的编码
+
+        返回:
+            dict: {slot: {value code: numpy.array}}，numpy.array 为升序排列的条目位置
+        """
+
+        postings = defaultdict(lambda: defaultdict(list))
+        for pos, id in enumerate(self.row_ids):
+            for k, v in self.database[id].items():
+                postings[k][self.vocab[v]].append(pos)
+        index = {}
+        for k, values in postings.items():
+            index[k] = {}
+            for v, rows in values.items():
+                # posting会作为查询结果直接返回，所以设为只读
+                index[k][v] = np.array(rows, dtype=np.int64)
+                index[k][v].flags.writeable = False
+        return index
+
+    def _build_columns(self):
+        """
+        将db转换为列式存储，每个slot对应一个int类型的numpy array，存储的是每个条目的value在词表中的编码
+
+        返回:
+            dict: {slot: numpy.array}，每个slot的编码列，条目中没有此slot时为MISSING_CODE
+        """
+
+        columns = {}
+        for k, values in self.index.items():
+            column = np.full(len(self.row_ids), MISSING_CODE, dtype=np.int32)
+            for code, rows in values.items():
+                column[rows] = code
+            columns[k] = column
+        return columns
+
+    def _build_raw_columns(self):
+        """
+        将db中区分大小写的原始value编码为列式存储，用于fill_inform_slot中统计value的出现次数
+
+        返回:
+            dict: {slot: list}，每个slot的原始value
+            dict: {slot: numpy.array}，每个slot的编码列，条目中没有此slot时为MISSING_CODE
+        """
+
+        raw_codes = defaultdict(dict)
+        raw_columns = {}
+        for pos, id in enumerate(self.row_ids):
+            for k, v in self.database[id].items():
+                if k not in raw_columns:
+                    raw_columns[k] = np.full(len(self.row_ids), MISSING_CODE, dtype=np.int32)
+                raw_columns[k][pos] = raw_codes[k].setdefault(v, len(raw_codes[k]))
+        raw_values = {k: list(codes) for k, codes in raw_codes.items()}
+        return raw_values, raw_columns
+
+    def _match_rows(self, constraints):
+        """
+        利用倒排索引，返回满足所有约束条件的db条目位置
+
+        从条目数最少的posting开始依次求交集，所以查询的开销只与满足条件的条目数有关，而与db的大小无关。
+
+        参数:
+            constraints (dict): 已过滤掉no query keys以及'anything'的约束条件
+
+        返回:
+            numpy.array: 升序排列的条目位置
+        """
+
+        if not constraints:
+            return self.all_rows
+
+        postings = []
+        for k, v in constraints.items():
+            rows = self.index.get(k, {}).get(self.encode_value(v))
+            # 只要有一个约束条件在db中找不到，就没有满足条件的条目
+            if rows is None:
+                return NO_ROWS
+            postings.append(rows)
+
+        postings.sort(key=len)
+        rows = postings[0]
+        for other in postings[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+            if not len(rows):
+                return NO_ROWS
+        return rows
+
+    def encode_value(self, value):
+        """
+        返回value在词表中的编码
+
+        db中出现过的value（包括原始写法）直接查表，只有db中没有的写法才需要先转换为小写。
+
+        参数:
+            value (string)
+
+        返回:
+            int: value的编码，不在词表中时为UNKNOWN_CODE
+        """
+
+        code = self.vocab.get(value)
+        if code is None:
+            code = self.vocab.get(normalize_slot_value(value), UNKNOWN_CODE)
+        return code
+
+    def narrow_rows(self, rows, key, code):
+        """
+        在已有查询结果的基础上增加一个约束条件，返回仍然满足条件的db条目位置
+
+        开销只与rows的大小有关。列式存储时直接比较rows对应的编码，否则与倒排索引中的posting求交集。
+
+        参数:
+            rows (numpy.array): 满足现有约束条件的条目位置，升序排列
+            key (string): 新增约束条件的slot
+            code (int): 新增约束条件的value的编码，见encode_value
+
+        返回:
+            numpy.array: 升序排列的条目位置
+        """
+
+        if self.columnar:
+            column = self.columns.get(key)
+            if column is None or not len(rows):
+                return NO_ROWS
+            rows = rows[column[rows] == code]
+        else:
+            posting = self.index.get(key, {}).get(code)
+            if posting is None:
+                return NO_ROWS
+            rows = np.intersect1d(rows, posting, assume_unique=True)
+        return rows if len(rows) else NO_ROWS
+
+    def is_query_constraint(self, key, value):
+        """
+        判断slot-value对是否需要作为约束条件来查询db，no query keys以及value为'anything'的不需要查询
+
+        参数:
+            key (string)
+            value (string)
+
+        返回:
+            bool
+        """
+
+        return key not in self.no_query and value != 'anything'
+
+    def get_row(self, pos):
+        """
+        返回db中位置为pos的条目
+
+        参数:
+            pos (int): 条目位置
+
+        返回:
+            int: 条目的id
+            dict: 条目的信息
+        """
+
+        id = self.row_ids[pos]
+        return id, self.database[id]
+
+    def fill_inform_slot(self, inform_slot_to_fill, current_inform_slots, rows=None):
         """
         Given the current informs/constraints fill the informs that need to be filled with values from the database.
 
@@ -30,6 +464,8 @@ class DBQuery:
         参数:
             inform_slot_to_fill (dict): 需要查询values的Inform slots
             current_inform_slots (dict): StateTracker中现有的已知values的inform slots
+            rows (numpy.array): 可选，除去需要填充的key之外满足current_inform_slots中所有约束条件的条目位置，
+                                给出时不需要再查询db
 
         返回:
             dict: inform_slot_to_fill 被填充好values的inform_slot_to_fill
@@ -38,141 +474,152 @@ class DBQuery:
         # 在这个框架里，每一回合里inform slot 只允许有一个
         assert len(inform_slot_to_fill) == 1
         # 取第一个（也是唯一的一个）key,即词槽
-        key = list(inform_slot_to_fill.keys())[0]
-
-        # 深拷贝current_inform_slots为current_informs
-        # 如里key在current_inform_slots中已存在，则在current_inform_slots中去除这个key
-        # 这样这个key就可以被重复查询
-        current_informs = copy.deepcopy(current_inform_slots)
-        current_informs.pop(key, None)
-
-        # 在current_informs的条件下，返回符合条件的信息，相当于返回结果是一个db的subset
-        db_results = self.get_db_results(current_informs)
-
-        # 利用_count_slot_values函数在db中查询key可能的取值以及相应的数量，返回以values-occurrences为键值对的dict
-        # 将occurrence最大的value 作为key 的 value，如果没有则no match available
-        filled_inform = {}
-        values_dict = self._count_slot_values(key, db_results)
-        if values_dict:
-            # 取occurrence最大的value作为key的value
-            filled_inform[key] = max(values_dict, key=values_dict.get)
-        else:
-            filled_inform[key] = 'no match available'
+        key = next(iter(inform_slot_to_fill))
+
+        # 如里key在current_inform_slots中已存在，则在约束条件中去除这个key，这样这个key就可以被重复查询
+        # 在其余约束条件下，得到符合条件的条目位置，相当于db的一个subset
+        if rows is None:
+            rows = self.get_db_rows({k: v for k, v in current_inform_slots.items() if k != key})
+
+        # 在这些条目中查询key出现次数最多的value作为key的value，如果没有则no match available
+        value = self._most_common_value(key, rows)
+        return {key: value if value is not None else 'no match available'}
 
-        return filled_inform
+    def _most_common_value(self, key, rows):
+        """
+        返回key在rows对应的条目中出现次数最多的value，次数相同时取在rows中最先出现的value
+
+        列式存储时对rows对应的value编码做bincount，不需要生成db的sub-dict。value区分大小写，与db中存储的一致。
 
-    def _count_slot_values(self, key, db_subdict):
+        参数:
+            key (string): 需要查询的key
+            rows (numpy.array): 升序排列的条目位置
+
+        返回:
+            string: 出现次数最多的value，没有任何条目包含key时为None
         """
-        key为词槽，查询此词槽在db_subdict中对应的取值以及不同取值对应的出现次数
+
+        if not self.columnar:
+            values_dict = self._count_slot_values(key, rows)
+            # 取occurrence最大的value作为key的value
+            return max(values_dict, key=values_dict.get) if values_dict else None
+
+        column = self.raw_columns.get(key)
+        if column is None:
+            return None
+        codes = column[rows]
+        codes = codes[codes != MISSING_CODE]
+        if not len(codes):
+            return None
+        counts = np.bincount(codes)
+        # 出现次数最多的value中，取在rows中最先出现的那个，与按顺序计数再取max的结果相同
+        first = np.flatnonzero(counts[codes] == counts.max())[0]
+        return self.raw_values[key][codes[first]]
+
+    def _count_slot_values(self, key, rows):
+        """
+        key为词槽，查询此词槽在rows对应的条目中的取值以及不同取值对应的出现次数
         参数:
             key (string): 需要查询计数信息的key
-            db_subdict (dict): database 的一部分
+            rows (numpy.array): 条目位置
 
         返回:
             dict: key 所对应的 values 以及 occurrences
         """
 
         slot_values = defaultdict(int)  # init to 0
-        for id in db_subdict.keys():
-            current_option_dict = db_subdict[id]
+        for pos in rows:
+            current_option_dict = self.database[self.row_ids[pos]]
             # If there is a match
-            if key in current_option_dict.keys():
-                slot_value = current_option_dict[key]
+            if key in current_option_dict:
                 # This will add 1 to 0 if this is the first time this value has been encountered, or it will add 1
                 # to whatever was already in there
-                slot_values[slot_value] += 1
+                slot_values[current_option_dict[key]] += 1
         return slot_values
 
-    def get_db_results(self, constraints):
+    def get_db_rows(self, constraints):
         """
-        在现有的约束条件下，查询database，返回所有满足条件的电影信息
+        在现有的约束条件下，查询database，返回所有满足条件的条目位置
 
         参数:
             constraints (dict): 现有的informs信息
 
         返回:
-            dict: 满足条件的电影信息
+            numpy.array: 升序排列的条目位置，没有满足条件的条目时为NO_ROWS
         """
 
         # 过滤掉不需要查询的keys以及value为'anything'的keys
-        new_constraints = {k: v for k, v in constraints.items() if k not in self.no_query and v is not 'anything'}
+        new_constraints = {k: v for k, v in constraints.items() if self.is_query_constraint(k, v)}
 
         inform_items = frozenset(new_constraints.items())
-        cache_return = self.cached_db[inform_items]
-
-        if cache_return == None:
-            # If it is none then no matches fit with the constraints so return an empty dict
-            return {}
-        # if it isnt empty then return what it is
-        if cache_return:
-            return cache_return
-        # else continue on
-
-        available_options = {}
-        for id in self.database.keys():
-            current_option_dict = self.database[id]
-            # First check if that database item actually contains the inform keys
-            # Note: this assumes that if a constraint is not found in the db item then that item is not a match
-            if len(set(new_constraints.keys()) - set(self.database[id].keys())) == 0:
-                match = True
-                # Now check all the constraint values against the db values and if there is a mismatch don't store
-                for k, v in new_constraints.items():
-                    if str(v).lower() != str(current_option_dict[k]).lower():
-                        match = False
-                if match:
-                    # Update cache
-                    self.cached_db[inform_items].update({id: current_option_dict})
-                    available_options.update({id: current_option_dict})
-
-        # if nothing available then set the set of constraint items to none in cache
-        if not available_options:
-            self.cached_db[inform_items] = None
-
-        return available_options
-
-    def get_db_results_for_slots(self, current_informs):
+        rows = self.cached_db.get(inform_items)
+        if rows is None:
+            rows = self._match_rows(new_constraints)
+            # 空结果也会被缓存（negative result），共用NO_ROWS，不会额外分配内存
+            self.cached_db.put(inform_items, rows)
+        return rows
+
+    def get_db_results_for_slots(self, current_informs, rows=None, inform_items=None):
         """
         给定现有的 inform slot (key and value)，计算满足条件的database中的item数目
 
         参数:
             current_informs (dict): 现有的约束条件，形式为slot-value对
+            rows (numpy.array): 可选，满足current_informs中所有约束条件的条目位置（例如由StateTracker逐轮缩小得到），
+                                给出时不需要再查询db
+            inform_items (frozenset): 可选，current_informs的items组成的frozenset，用作缓存的key
         返回:
             dict: current_informs中的每个约束条件所对应的符合条件的item数目
         """
 
         # The items (key, value) of the current informs are used as a key to the cached_db_slot
-        inform_items = frozenset(current_informs.items())
+        if inform_items is None:
+            inform_items = frozenset(current_informs.items())
         # A dict of the inform keys and their counts as stored (or not stored) in the cached_db_slot
-        cache_return = self.cached_db_slot[inform_items]
+        cache_return = self.cached_db_slot.get(inform_items)
 
-        if cache_return:
+        if cache_return is not None:
             return cache_return
 
         # If it made it down here then a new query was made and it must add it to cached_db_slot and return it
-        # Init all key values with 0
+        db_results = self._count_slots_indexed(current_informs, rows)
+
+        # update cache
+        self.cached_db_slot.put(inform_items, db_results)
+        return db_results
+
+    def cache_stats(self):
+        """
+        返回两个查询缓存的统计数据（hits, misses, evictions, bytes 等）
+
+        返回:
+            dict: {'db': dict, 'db_slot': dict}
+        """
+
+        return {'db': self.cached_db.stats(), 'db_slot': self.cached_db_slot.stats()}
+
+    def _count_slots_indexed(self, current_informs, rows=None):
+        """
+        利用倒排索引计算每个约束条件的匹配数目（即posting的长度）以及满足所有约束条件的条目数目
+
+        参数:
+            current_informs (dict): 现有的约束条件，形式为slot-value对
+            rows (numpy.array): 可选，满足所有约束条件的条目位置
+        返回:
+            dict: current_informs中的每个约束条件所对应的符合条件的item数目
+        """
+
         db_results = {key: 0 for key in current_informs.keys()}
-        db_results['matching_all_constraints'] = 0
-
-        for id in self.database.keys():
-            all_slots_match = True
-            for CI_key, CI_value in current_informs.items():
-                # Skip if a no query item and all_slots_match stays true
-                if CI_key in self.no_query:
-                    continue
-                # If anything all_slots_match stays true AND the specific key slot gets a +1
-                if CI_value == 'anything':
-                    db_results[CI_key] += 1
-                    continue
-                if CI_key in self.database[id].keys():
-                    if CI_value.lower() == self.database[id][CI_key].lower():
-                        db_results[CI_key] += 1
-                    else:
-                        all_slots_match = False
-                else:
-                    all_slots_match = False
-            if all_slots_match: db_results['matching_all_constraints'] += 1
-
-        # update cache (set the empty dict)
-        self.cached_db_slot[inform_items].update(db_results)
-        assert self.cached_db_slot[inform_items] == db_results
+        constraints = {}
+        for CI_key, CI_value in current_informs.items():
+            if CI_key in self.no_query:
+                continue
+            if CI_value == 'anything':
+                db_results[CI_key] = len(self.row_ids)
+                continue
+            db_results[CI_key] = len(self.index.get(CI_key, {}).get(self.encode_value(CI_value), ()))
+            constraints[CI_key] = CI_value
+        if rows is None:
+            rows = self._match_rows(constraints)
+        db_results['matching_all_constraints'] = len(rows)
         return db_results
@@ -0,0 +1,133 @@
+from collections.abc import Mapping
+import numpy as np
+import struct
+import json
+
+# 每个array在内存块中的起始位置按此字节数对齐
+_ALIGN = 64
+# 内存块开头存储header（json）的字节数
+_HEADER_SIZE = struct.Struct('<Q')
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _layout(arrays, meta):
+    """
+    计算arrays在内存块中的位置，array的offset是相对于header之后数据区起始位置的
+
+    返回:
+        bytes: 编码后的header
+        int: 数据区的起始位置
+        int: 内存块的总字节数
+    """
+
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        specs[name] = [array.dtype.str, list(array.shape), offset]
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({'meta': meta, 'arrays': specs}).encode('utf-8')
+    base = _align(_HEADER_SIZE.size + len(header))
+    return header, base, base + offset
+
+
+def tables_nbytes(arrays, meta):
+    """
+    返回将arrays以及meta写入一块连续内存所需要的字节数
+
+    参数:
+        arrays (dict): {string: numpy.array}
+        meta (dict): 可以用json保存的其他信息
+
+    返回:
+        int
+    """
+
+    return _layout(arrays, meta)[2]
+
+
+def write_tables(buf, arrays, meta):
+    """
+    将arrays以及meta写入一块连续内存（例如共享内存或者文件）
+
+    参数:
+        buf (memoryview): 可写的内存，大小至少为 tables_nbytes(arrays, meta)
+        arrays (dict): {string: numpy.array}
+        meta (dict): 可以用json保存的其他信息
+    """
+
+    header, base, nbytes = _layout(arrays, meta)
+    if len(buf) < nbytes:
+        raise ValueError('Buffer of {} bytes is too small, {} bytes needed'.format(len(buf), nbytes))
+    _HEADER_SIZE.pack_into(buf, 0, len(header))
+    buf[_HEADER_SIZE.size:_HEADER_SIZE.size + len(header)] = header
+    specs = json.loads(header.decode('utf-8'))['arrays']
+    for name, array in arrays.items():
+        dtype, shape, offset = specs[name]
+        view = np.ndarray(shape, dtype=dtype, buffer=buf, offset=base + offset)
+        view[...] = array
+
+
+def read_tables(buf):
+    """
+    从一块连续内存中读取write_tables写入的arrays以及meta，arrays为这块内存上的只读view，不会复制数据
+
+    参数:
+        buf (memoryview)
+
+    返回:
+        dict: {string: numpy.array}
+        dict: meta
+    """
+
+    header_len = _HEADER_SIZE.unpack_from(buf, 0)[0]
+    header = json.loads(bytes(buf[_HEADER_SIZE.size:_HEADER_SIZE.size + header_len]).decode('utf-8'))
+    base = _align(_HEADER_SIZE.size + header_len)
+    arrays = {}
+    for name, (dtype, shape, offset) in header['arrays'].items():
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=base + offset)
+        arrays[name].flags.writeable = False
+    return arrays, header['meta']
+
+
+class TableRows(Mapping):
+    """以dict的方式访问列式存储的db，条目在被访问时才从编码列中还原出来"""
+
+    def __init__(self, row_ids, slots, raw_values, raw_columns):
+        """
+        参数:
+            row_ids (numpy.array): 条目的id
+            slots (list): 所有slot，与raw_columns的行对应
+            raw_values (list): 每个slot的原始value
+            raw_columns (numpy.array): 形状为 (len(slots), len(row_ids)) 的编码矩阵，缺失的slot为负数
+        """
+
+        self.row_ids = row_ids
+        self.slots = slots
+        self.raw_values = raw_values
+        self.raw_columns = raw_columns
+        self._positions = None
+
+    def position(self, id):
+        """返回id对应的条目位置"""
+
+        if self._positions is None:
+            self._positions = {id: pos for pos, id in enumerate(self.row_ids.tolist())}
+        return self._positions[id]
+
+    def row(self, pos):
+        """返回位置为pos的条目"""
+
+        codes = self.raw_columns[:, pos]
+        return {self.slots[i]: self.raw_values[i][code] for i, code in enumerate(codes.tolist()) if code >= 0}
+
+    def __getitem__(self, id):
+        return self.row(self.position(id))
+
+    def __iter__(self):
+        return iter(self.row_ids.tolist())
+
+    def __len__(self):
+        return len(self.row_ids)
@@ -1,16 +1,13 @@
-from keras.models import Sequential
-from keras.layers import Dense
-from keras.optimizers import Adam
-import random, copy
 import numpy as np
-from dialogue_config import rule_requests, agent_actions
+from replay_memory import ReplayMemory, PrioritizedReplayMemory
+from dqn_policy import DQNPolicy
 import re
 
 
-class DQNAgent:
-    """强化学习模型"""
+class DQNAgent(DQNPolicy):
+    """强化学习模型，在 DQNPolicy 的基础上加入Keras模型的训练以及memory"""
 
-    def __init__(self, state_size, constants):
+    def __init__(self, state_size, constants, state_codec=None):
         """
         The constructor of DQNAgent.
 
@@ -19,19 +16,18 @@ class DQNAgent:
         参数:
             state_size (int): 状态维度
             constants (dict): 配置参数
+            state_codec (StateCodec): 可选，memory中states的紧凑存储格式，见 StateTracker.get_state_codec
 
         """
 
         self.C = constants['agent']
-        self.memory = []
-        self.memory_index = 0
         self.max_memory_size = self.C['max_mem_size']
-        self.eps = self.C['epsilon_init']
         self.vanilla = self.C['vanilla']
         self.lr = self.C['learning_rate']
         self.gamma = self.C['gamma']
         self.batch_size = self.C['batch_size']
         self.hidden_size = self.C['dqn_hidden_size']
+        self.prioritized_replay = self.C['prioritized_replay']
 
         self.load_weights_file_path = self.C['load_weights_file_path']
         self.save_weights_file_path = self.C['save_weights_file_path']
@@ -39,131 +35,40 @@ class DQNAgent:
         if self.max_memory_size < self.batch_size:
             raise ValueError('Max memory size must be at least as great as batch size!')
 
-        self.state_size = state_size
-        self.possible_actions = agent_actions
-        self.num_actions = len(self.possible_actions)
-
-        self.rule_request_set = rule_requests
+        super().__init__(state_size, constants)
+        if self.prioritized_replay:
+            self.memory = PrioritizedReplayMemory(self.max_memory_size, self.state_size, self.C['per_alpha'],
+                                                  self.C['per_beta'], self.C['per_epsilon'], codec=state_codec,
+                                                  intern_states=self.C['intern_states'])
+        else:
+            self.memory = ReplayMemory(self.max_memory_size, self.state_size, codec=state_codec,
+                                       intern_states=self.C['intern_states'])
 
         self.beh_model = self._build_model()
         self.tar_model = self._build_model()
 
         self._load_weights()
-
-        self.reset()
+        self._sync_weights()
 
     def _build_model(self):
         """创建NN模型，输入为state representation，输出为action"""
 
+        # 只在需要训练的模型时才导入Keras，只做推断时不需要（见 DQNPolicy.load_beh_weights）
+        from keras.models import Sequential
+        from keras.layers import Dense
+        from keras.optimizers import Adam
+
         model = Sequential()
         model.add(Dense(self.hidden_size, input_dim=self.state_size, activation='relu'))
         model.add(Dense(self.num_actions, activation='linear'))
         model.compile(loss='mse', optimizer=Adam(lr=self.lr))
         return model
 
-    def reset(self):
-        """Resets the rule-based variables."""
-
-        self.rule_current_slot_index = 0
-        self.rule_phase = 'not done'
-
-    def get_action(self, state, use_rule=False):
-        """
-        根据state返回agent action
-        两种可选策略：随机生成action;
-                    rule-based policy（基于规则）或者 neural networks（基于深度学习网络）来选择 action
-
-        参数:
-            state (numpy.array): The database with format dict(long: dict)
-            use_rule (bool): 指明是否使用 rule-based policy, 默认为False。
-                             取决于使用warmup模式（取True）还是training模式(取False).
-
-        返回:
-            int: action的标号
-            dict: action/response
-
-        """
-
-        if self.eps > random.random():
-            index = random.randint(0, self.num_actions - 1)
-            action = self._map_index_to_action(index)
-            return index, action
-        else:
-            if use_rule:
-                return self._rule_action()
-            else:
-                return self._dqn_action(state)
-
-    def _rule_action(self):
-        """
-        返回基于rule-based policy 得到的action
-
-        Returns:
-            int: action的标号
-            dict: action/response
-
-        """
-
-        if self.rule_current_slot_index < len(self.rule_request_set):
-            slot = self.rule_request_set[self.rule_current_slot_index]
-            self.rule_current_slot_index += 1
-            rule_response = {'intent': 'request', 'inform_slots': {}, 'request_slots': {slot: 'UNK'}}
-        elif self.rule_phase == 'not done':
-            rule_response = {'intent': 'match_found', 'inform_slots': {}, 'request_slots': {}}
-            self.rule_phase = 'done'
-        elif self.rule_phase == 'done':
-            rule_response = {'intent': 'done', 'inform_slots': {}, 'request_slots': {}}
-        else:
-            raise Exception('Should not have reached this clause')
-
-        index = self._map_action_to_index(rule_response)
-        return index, rule_response
-
-    def _map_action_to_index(self, response):
-        """
-        输出action对应的序号
-
-        参数:
-            response (dict)，即为一个action
-
-        返回:
-            int
-        """
-
-        for (i, action) in enumerate(self.possible_actions):
-            if response == action:
-                return i
-        raise ValueError('Response: {} not found in possible actions'.format(response))
-
-    def _dqn_action(self, state):
-        """
-        返回neural networks（基于深度学习网络）预测得到的 action
-
-        参数:
-            state (numpy.array)
-
-        返回:
-            int: action的标号
-            dict: action/response
-        """
+    def _sync_weights(self):
+        """将behavior model以及target model的参数权重复制为numpy arrays，用于_dqn_predict_one，模型权重改变后需要调用"""
 
-        index = np.argmax(self._dqn_predict_one(state))
-        action = self._map_index_to_action(index)
-        return index, action
-
-    def _dqn_predict_one(self, state, target=False):
-        """
-        利用neural networks，根据state预测action （一个输入）
-
-        参数:
-            state (numpy.array)
-            target (bool)
-
-        返回:
-            numpy.array
-        """
-
-        return self._dqn_predict(state.reshape(1, self.state_size), target=target).flatten()
+        self.beh_weights = self.beh_model.get_weights()
+        self.tar_weights = self.tar_model.get_weights()
 
     def _dqn_predict(self, states, target=False):
         """
@@ -182,27 +87,10 @@ class DQNAgent:
         else:
             return self.beh_model.predict(states)
 
-    def _map_index_to_action(self, index):
-        """
-        输出序号对应的action
-
-        参数:
-            index (int)
-
-        返回:
-            dict
-        """
-
-        for (i, action) in enumerate(self.possible_actions):
-            if index == i:
-                return copy.deepcopy(action)
-        raise ValueError('Index: {} not in range of possible actions'.format(index))
-
-
     def add_experience(self, state, action, reward, next_state, done):
         """
         将experience（包括 state, action, reward, next_state, done） 添加至 memory
-        存储方式为memory[memory_index] = (state, action, reward, next_state, done)
+        state以及next_state会被复制到memory中，调用者可以继续使用原来的array
         参数:
             state (numpy.array) 当前状态
             action (int) 行为
@@ -212,21 +100,32 @@ class DQNAgent:
 
         """
 
-        if len(self.memory) < self.max_memory_size:
-            self.memory.append(None)
-        self.memory[self.memory_index] = (state, action, reward, next_state, done)
-        self.memory_index = (self.memory_index + 1) % self.max_memory_size
+        self.memory.add(state, action, reward, next_state, done)
+
+    def add_experiences(self, states, actions, rewards, next_states, dones):
+        """
+        将多个experience一次性添加至 memory，参数为 add_experience 各参数按行堆叠的array
+
+        参数:
+            states (numpy.array) 当前状态，形状为 (experience数目, state size)
+            actions (numpy.array) 行为
+            rewards (numpy.array) 反馈
+            next_states (numpy.array) 下一个状态
+            dones (numpy.array) 是否完成对话
+
+        """
+
+        self.memory.add_batch(states, actions, rewards, next_states, dones)
 
     def empty_memory(self):
         """清空 memory """
 
-        self.memory = []
-        self.memory_index = 0
+        self.memory.clear()
 
     def is_memory_full(self):
         """查看memory是否已满"""
 
-        return len(self.memory) == self.max_memory_size
+        return self.memory.is_full()
 
     def train(self):
         """
@@ -239,41 +138,47 @@ class DQNAgent:
 
         # 计算batch数量，num_batches = len(memory) // batch_size
         num_batches = len(self.memory) // self.batch_size
-        for b in range(num_batches):
-            # 从memory里随机取batch_size大小的样例
-            batch = random.sample(self.memory, self.batch_size)
-            # 取出样例中的states以及next_states
-            states = np.array([sample[0] for sample in batch])
-            next_states = np.array([sample[3] for sample in batch])
-
-            assert states.shape == (self.batch_size, self.state_size), 'States Shape: {}'.format(states.shape)
-            assert next_states.shape == states.shape
-            # 根据states,利用深度模型预测action
-            beh_state_preds = self._dqn_predict(states)  # For leveling error
-            # vanilla表示用DQN, not vanilla表示用 Double DQN
-            if not self.vanilla:
-                beh_next_states_preds = self._dqn_predict(next_states)  # For indexing for DDQN
-            tar_next_state_preds = self._dqn_predict(next_states, target=True)  # For target value for DQN (& DDQN)
-
-            inputs = np.zeros((self.batch_size, self.state_size))
-            targets = np.zeros((self.batch_size, self.num_actions))
-
-            for i, (s, a, r, s_, d) in enumerate(batch):
-                t = beh_state_preds[i]
-                if not self.vanilla:
-                    t[a] = r + self.gamma * tar_next_state_preds[i][np.argmax(beh_next_states_preds[i])] * (not d)
-                else:
-                    t[a] = r + self.gamma * np.amax(tar_next_state_preds[i]) * (not d)
-
-                inputs[i] = s
-                targets[i] = t
-
-            self.beh_model.fit(inputs, targets, epochs=1, verbose=0)
+        if num_batches == 0:
+            return
+        # 从memory里为每个batch随机取batch_size大小的样例（batch内不重复），一次性取出这个训练周期所有的
+        # states, actions, rewards, next_states, dones
+        indices = np.concatenate([self.memory.sample(self.batch_size) for _ in range(num_batches)])
+        states, actions, rewards, next_states, dones = self.memory.get(indices)
+        num_samples = num_batches * self.batch_size
+
+        assert states.shape == (num_samples, self.state_size), 'States Shape: {}'.format(states.shape)
+        assert next_states.shape == states.shape
+        # 根据states,利用深度模型预测action，作为targets中未被选择的action的值
+        targets = self._dqn_predict(states)  # For leveling error
+        tar_next_state_preds = self._dqn_predict(next_states, target=True)  # For target value for DQN (& DDQN)
+        # vanilla表示用DQN, not vanilla表示用 Double DQN
+        if not self.vanilla:
+            beh_next_states_preds = self._dqn_predict(next_states)  # For indexing for DDQN
+            next_q = tar_next_state_preds[np.arange(num_samples), np.argmax(beh_next_states_preds, axis=1)]
+        else:
+            next_q = np.amax(tar_next_state_preds, axis=1)
+
+        # Bellman equation，done的样例没有下一个状态的值
+        target_q = rewards + self.gamma * next_q * (1 - dones)
+        # prioritized replay时用importance-sampling weights修正按priority采样带来的偏差
+        sample_weight = None
+        if self.prioritized_replay:
+            sample_weight = self.memory.importance_weights(indices)
+            td_errors = target_q - targets[np.arange(num_samples), actions]
+        targets[np.arange(num_samples), actions] = target_q
+
+        # 按batch的顺序依次更新，整个训练周期只调用一次fit
+        self.beh_model.fit(states, targets, batch_size=self.batch_size, epochs=1, verbose=0, shuffle=False,
+                           sample_weight=sample_weight)
+        self._sync_weights()
+        if self.prioritized_replay:
+            self.memory.update_priorities(indices, td_errors)
 
     def copy(self):
         """将behavior model的参数权重复制到target model中"""
 
         self.tar_model.set_weights(self.beh_model.get_weights())
+        self._sync_weights()
 
     def save_weights(self):
         """保存模型参数权重"""
@@ -0,0 +1,264 @@
+import random
+import re
+import numpy as np
+from dialogue_config import rule_requests, agent_actions
+from action_table import ActionTable
+
+
+class DQNPolicy:
+    """
+    agent选择action的策略，不依赖Keras：epsilon随机、rule-based policy 以及用numpy计算的神经网络前向传播
+
+    DQNAgent 在此基础上加入模型的训练；rollout workers 只使用这个类，以从learner收到的参数权重选择action；
+    只做推断时（test.py）用 load_beh_weights 从保存的模型文件中读取参数权重，不需要导入Keras。
+    """
+
+    def __init__(self, state_size, constants):
+        """
+        参数:
+            state_size (int): 状态维度
+            constants (dict): 配置参数
+        """
+
+        self.state_size = state_size
+        self.eps = constants['agent']['epsilon_init']
+
+        self.possible_actions = agent_actions
+        self.action_table = ActionTable(self.possible_actions)
+        self.num_actions = len(self.action_table)
+
+        self.rule_request_set = rule_requests
+        # rule-based policy 中依次使用的actions的序号
+        self.rule_request_indices = [self.action_table.lookup('request', request_slot=slot)
+                                     for slot in self.rule_request_set]
+        self.match_found_index = self.action_table.lookup('match_found')
+        self.done_index = self.action_table.lookup('done')
+
+        # behavior model以及target model的参数权重，由 set_weights 或者 load_beh_weights 设置
+        self.beh_weights = None
+        self.tar_weights = None
+
+        self.reset()
+
+    def set_weights(self, weights):
+        """
+        设置选择action时使用的参数权重
+
+        参数:
+            weights (list): Keras model.get_weights() 的结果
+        """
+
+        self.beh_weights = weights
+
+    def load_beh_weights(self, file_path):
+        """
+        从DQNAgent.save_weights保存的behavior model文件（file_path中的'.h5'替换为'_beh.h5'）读取参数权重，
+        只使用h5py，不需要导入Keras
+
+        参数:
+            file_path (string): 与配置中的load_weights_file_path相同，例如 'weights/model.h5'
+        """
+
+        import h5py
+
+        beh_load_file_path = re.sub(r'\.h5', r'_beh.h5', file_path)
+        weights = []
+        with h5py.File(beh_load_file_path, 'r') as f:
+            # Keras保存的格式：按层的顺序，每一层的group中按weight_names的顺序保存kernel以及bias
+            for layer_name in f.attrs['layer_names']:
+                group = f[_to_str(layer_name)]
+                for weight_name in group.attrs['weight_names']:
+                    weights.append(np.array(group[_to_str(weight_name)], dtype=np.float32))
+        self.set_weights(weights)
+
+    def reset(self):
+        """Resets the rule-based variables."""
+
+        self.rule_current_slot_index = 0
+        self.rule_phase = 'not done'
+
+    def get_action(self, state, use_rule=False):
+        """
+        根据state返回agent action
+        两种可选策略：随机生成action;
+                    rule-based policy（基于规则）或者 neural networks（基于深度学习网络）来选择 action
+
+        参数:
+            state (numpy.array): The database with format dict(long: dict)
+            use_rule (bool): 指明是否使用 rule-based policy, 默认为False。
+                             取决于使用warmup模式（取True）还是training模式(取False).
+
+        返回:
+            int: action的标号
+            SemanticFrame: action/response
+
+        """
+
+        if self.eps > random.random():
+            index = random.randint(0, self.num_actions - 1)
+            action = self._map_index_to_action(index)
+            return index, action
+        else:
+            if use_rule:
+                return self._rule_action()
+            else:
+                return self._dqn_action(state)
+
+    def _rule_action(self):
+        """
+        返回基于rule-based policy 得到的action
+
+        Returns:
+            int: action的标号
+            SemanticFrame: action/response
+
+        """
+
+        if self.rule_current_slot_index < len(self.rule_request_set):
+            index = self.rule_request_indices[self.rule_current_slot_index]
+            self.rule_current_slot_index += 1
+        elif self.rule_phase == 'not done':
+            index = self.match_found_index
+            self.rule_phase = 'done'
+        elif self.rule_phase == 'done':
+            index = self.done_index
+        else:
+            raise Exception('Should not have reached this clause')
+
+        return index, self._map_index_to_action(index)
+
+    def _map_action_to_index(self, response):
+        """
+        输出action对应的序号
+
+        参数:
+            response (SemanticFrame or dict)，即为一个action
+
+        返回:
+            int
+        """
+
+        return self.action_table.to_index(response)
+
+    def _dqn_action(self, state):
+        """
+        返回neural networks（基于深度学习网络）预测得到的 action
+
+        参数:
+            state (numpy.array)
+
+        返回:
+            int: action的标号
+            SemanticFrame: action/response
+        """
+
+        index = int(np.argmax(self._dqn_predict_one(state)))
+        action = self._map_index_to_action(index)
+        return index, action
+
+    def _dqn_predict_one(self, state, target=False):
+        """
+        利用neural networks，根据state预测action （一个输入）
+
+        单个输入时直接用numpy计算前向传播，避免每次调用Keras predict的固定开销。
+
+        参数:
+            state (numpy.array)
+            target (bool)
+
+        返回:
+            numpy.array
+        """
+
+        weights = self.tar_weights if target else self.beh_weights
+        return self._numpy_predict(state.reshape(1, self.state_size), weights).flatten()
+
+    def _map_index_to_action(self, index):
+        """
+        输出序号对应的action，每次返回新的frame
+
+        参数:
+            index (int)
+
+        返回:
+            SemanticFrame
+        """
+
+        return self.action_table.to_action(index)
+
+    def get_actions(self, states, use_rule=False, rule_steps=None):
+        """
+        为多个对话同时选择action，用于 VecDialogueEnv。每个对话的策略与 get_action 相同，
+        需要neural networks预测的对话只进行一次前向传播。
+
+        参数:
+            states (numpy.array): 形状为 (对话数目, state size)
+            use_rule (bool): 指明是否使用 rule-based policy
+            rule_steps (numpy.array): use_rule为True时需要，每个对话已经使用rule-based policy的次数，
+                                      使用rule-based policy的对话对应的值会加1
+
+        返回:
+            numpy.array: 每个对话的action的标号
+        """
+
+        num_states = len(states)
+        indices = np.empty(num_states, dtype=np.int64)
+        greedy = []
+        for i in range(num_states):
+            if self.eps > random.random():
+                indices[i] = random.randint(0, self.num_actions - 1)
+            elif use_rule:
+                indices[i] = self._rule_index(rule_steps[i])
+                rule_steps[i] += 1
+            else:
+                greedy.append(i)
+        if greedy:
+            q_values = self._numpy_predict(states[greedy], self.beh_weights)
+            indices[greedy] = np.argmax(q_values, axis=1)
+        return indices
+
+    def _rule_index(self, step):
+        """
+        rule-based policy 在一个对话中第step次（从0开始）选择的action的标号，与 _rule_action 的顺序相同：
+        依次request rule_request_set中的slots，然后match_found，之后一直done
+
+        参数:
+            step (int)
+
+        返回:
+            int
+        """
+
+        if step < len(self.rule_request_indices):
+            return self.rule_request_indices[step]
+        elif step == len(self.rule_request_indices):
+            return self.match_found_index
+        else:
+            return self.done_index
+
+    @staticmethod
+    def _numpy_predict(states, weights):
+        """
+        用numpy计算神经网络的前向传播，结构与DQNAgent._build_model相同：隐藏层为relu，输出层为linear
+
+        参数:
+            states (numpy.array)
+            weights (list): Keras model.get_weights() 的结果，依次为每一层的kernel和bias
+
+        返回:
+            numpy.array
+        """
+
+        outputs = states.astype(np.float32)
+        num_layers = len(weights) // 2
+        for i in range(num_layers):
+            outputs = outputs @ weights[2 * i] + weights[2 * i + 1]
+            if i < num_layers - 1:
+                outputs = np.maximum(outputs, 0.0)
+        return outputs
+
+
+def _to_str(name):
+    """h5py中的属性可能是bytes"""
+
+    return name.decode('utf-8') if isinstance(name, bytes) else name
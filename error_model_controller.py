@@ -25,18 +25,18 @@ class ErrorModelController:
 
     def infuse_error(self, frame):
         """
-        Takes a semantic frame/action as a dict and adds 'error'.
+        Takes a semantic frame/action and adds 'error'.
 
         Given a dict/frame it adds error based on specifications in constants. It can either replace slot values,
         replace slot and its values, delete a slot or do all three. It can also randomize the intent.
 
         Parameters:
-            frame (dict): format dict('intent': '', 'inform_slots': {}, 'request_slots': {}, 'round': int,
-                          'speaker': 'User')
+            frame (SemanticFrame): The user action, its inform slots are changed in place
         """
 
-        informs_dict = frame['inform_slots']
-        for key in list(frame['inform_slots'].keys()):
+        # frame可能与其他frame共享inform_slots，修改前先取得自己的dict
+        informs_dict = frame.mutable_inform_slots()
+        for key in list(informs_dict.keys()):
             assert key in self.movie_dict
             if random.random() < self.slot_error_prob:
                 if self.slot_error_mode == 0:  # replace the slot_value only
@@ -54,7 +54,7 @@ class ErrorModelController:
                     else:
                         self._slot_remove(key, informs_dict)
         if random.random() < self.intent_error_prob:  # add noise for intent level
-            frame['intent'] = random.choice(self.intents)
+            frame.intent = random.choice(self.intents)
 
     def _slot_value_noise(self, key, informs_dict):
         """
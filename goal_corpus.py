@@ -0,0 +1,252 @@
+from db_tables import tables_nbytes, write_tables, read_tables
+from goal_table import GoalVocab, UserGoal
+import numpy as np
+import argparse, json, mmap, os, random
+
+# 索引文件的格式版本，格式改变时加1，旧的索引会被重新生成
+INDEX_VERSION = 1
+_SAMPLINGS = ('uniform', 'weighted', 'stratified')
+
+
+def _alias_table(weights):
+    """
+    Walker/Vose alias method，O(n)建表，之后每次O(1)采样：
+    随机选i，以概率prob[i]返回i，否则返回alias[i]
+
+    参数:
+        weights (numpy.array): 非负的权重
+
+    返回:
+        numpy.array: prob, float64
+        numpy.array: alias, int64
+    """
+
+    n = len(weights)
+    scaled = (weights * (n / weights.sum())).tolist()
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+    small = [i for i, p in enumerate(scaled) if p < 1.]
+    large = [i for i, p in enumerate(scaled) if p >= 1.]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1. - scaled[s]
+        (small if scaled[l] < 1. else large).append(l)
+    # 剩下的（浮点误差）概率为1
+    return prob, alias
+
+
+def build_index(file_path, weight_key='', stratify_key=''):
+    """
+    扫描一遍goal文件（每行一个json格式的user goal），生成索引文件 file_path + '.idx'
+
+    索引包括每行的起始位置，以及可选的按weight_key的alias table和按stratify_key排序的goal序号。
+    只有需要weights或者strata时才解析每一行。
+
+    参数:
+        file_path (string): goal文件
+        weight_key (string): 权重所在的key，为空时不生成alias table，没有这个key的goal权重为1
+        stratify_key (string): 分层所在的key，为空时不分层，没有这个key的goal属于 'None' 层
+
+    返回:
+        string: 索引文件
+    """
+
+    parse = bool(weight_key or stratify_key)
+    offsets, weights, strata = [], [], []
+    strata_ids = {}
+    with open(file_path, 'rb') as f:
+        position = 0
+        for line in f:
+            if line.strip():
+                offsets.append(position)
+                if parse:
+                    goal = json.loads(line)
+                    if weight_key:
+                        weights.append(float(goal.get(weight_key, 1.)))
+                    if stratify_key:
+                        strata.append(strata_ids.setdefault(str(goal.get(stratify_key)), len(strata_ids)))
+            position += len(line)
+    offsets.append(position)
+
+    stat = os.stat(file_path)
+    arrays = {'offsets': np.array(offsets, dtype=np.int64)}
+    meta = {'version': INDEX_VERSION, 'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns,
+            'weight_key': weight_key, 'stratify_key': stratify_key, 'strata': list(strata_ids)}
+    if weight_key:
+        weights = np.array(weights, dtype=np.float64)
+        if (weights < 0).any() or not weights.sum() > 0:
+            raise ValueError('Goal weights under "{}" must be non negative and not all 0!'.format(weight_key))
+        arrays['alias_prob'], arrays['alias'] = _alias_table(weights)
+    if stratify_key:
+        strata = np.array(strata, dtype=np.int32)
+        # 按层排序的goal序号，第s层为 strata_order[strata_offsets[s]:strata_offsets[s + 1]]
+        arrays['strata_order'] = np.argsort(strata, kind='stable').astype(np.int64)
+        arrays['strata_offsets'] = np.searchsorted(strata[arrays['strata_order']],
+                                                   np.arange(len(strata_ids) + 1)).astype(np.int64)
+
+    index_path = file_path + '.idx'
+    buf = bytearray(tables_nbytes(arrays, meta))
+    write_tables(memoryview(buf), arrays, meta)
+    with open(index_path + '.tmp', 'wb') as f:
+        f.write(buf)
+    os.replace(index_path + '.tmp', index_path)
+    return index_path
+
+
+def write_goal_file(user_goals, file_path):
+    """
+    将user goals（例如从pickle加载的list，也可以是generator）逐行写为goal文件
+
+    参数:
+        user_goals (iterable): 用户目的样例（dict）
+        file_path (string): 输出的goal文件
+
+    返回:
+        int: goal数目
+    """
+
+    count = 0
+    with open(file_path + '.tmp', 'w') as f:
+        for goal in user_goals:
+            f.write(json.dumps(goal) + '\n')
+            count += 1
+    os.replace(file_path + '.tmp', file_path)
+    return count
+
+
+class GoalCorpus:
+    """
+    内存映射的大规模user goal文件，可以替代 GoalTable 给 UserSimulator 使用
+
+    goal文件每行为一个json格式的user goal，通过索引文件（build_index）中每行的起始位置直接读取第i个goal，
+    采样时才解析并编译为 UserGoal（只给slots编号，value_ids为None），不会把所有goal加载为dict，内存不随goal数目增长。
+    采样方式（均为O(1)）：
+    'uniform' 均匀采样（与 GoalTable.sample 使用相同的随机数，goal顺序相同时结果相同）；
+    'weighted' 按weight_key的权重采样（alias method）；
+    'stratified' 先均匀地选一层（stratify_key的取值），再在层内均匀采样。
+    """
+
+    def __init__(self, constants):
+        """
+        参数:
+            constants (dict): 配置参数，使用其中的 goal_corpus
+        """
+
+        corpus_dict = constants['goal_corpus']
+        self.constants = constants
+        self.file_path = corpus_dict['file_path']
+        self.sampling = corpus_dict['sampling']
+        self.weight_key = corpus_dict['weight_key']
+        self.stratify_key = corpus_dict['stratify_key']
+        if self.sampling not in _SAMPLINGS:
+            raise ValueError('Goal sampling must be one of {}!'.format(_SAMPLINGS))
+        if self.sampling == 'weighted' and not self.weight_key:
+            raise ValueError('Weighted goal sampling needs a weight_key!')
+        if self.sampling == 'stratified' and not self.stratify_key:
+            raise ValueError('Stratified goal sampling needs a stratify_key!')
+
+        arrays, meta = self._load_index()
+        if not self._is_current(meta):
+            build_index(self.file_path, self.weight_key, self.stratify_key)
+            arrays, meta = self._load_index()
+        self.offsets = arrays['offsets']
+        self.num_goals = len(self.offsets) - 1
+        if self.num_goals == 0:
+            raise ValueError('Goal file {} is empty!'.format(self.file_path))
+        self.alias_prob = arrays.get('alias_prob')
+        self.alias = arrays.get('alias')
+        self.strata = meta['strata']
+        self.strata_order = arrays.get('strata_order')
+        self.strata_offsets = arrays.get('strata_offsets')
+
+        with open(self.file_path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # 只用于slots的编号，不给values编号（否则采样过的所有不同的values都会留在内存中）
+        self.vocab = GoalVocab(number_values=False)
+        self.slots = self.vocab.slots
+        self.slot_ids = self.vocab.slot_ids
+
+    def _load_index(self):
+        """内存映射索引文件，不存在时返回 ({}, None)"""
+
+        index_path = self.file_path + '.idx'
+        if not os.path.exists(index_path):
+            return {}, None
+        with open(index_path, 'rb') as f:
+            self._index_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return read_tables(memoryview(self._index_mmap))
+
+    def _is_current(self, meta):
+        """索引是否对应当前的goal文件以及weight_key, stratify_key"""
+
+        if meta is None:
+            return False
+        stat = os.stat(self.file_path)
+        return (meta['version'] == INDEX_VERSION and meta['source_size'] == stat.st_size and
+                meta['source_mtime_ns'] == stat.st_mtime_ns and meta['weight_key'] == self.weight_key and
+                meta['stratify_key'] == self.stratify_key)
+
+    def __len__(self):
+        return self.num_goals
+
+    def __getitem__(self, index):
+        """读取并编译第index个goal"""
+
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return UserGoal(index, json.loads(self.mmap[start:end]), self.vocab)
+
+    def slot_id(self, slot):
+        """slot的编号，与 GoalTable.slot_id 相同，不在编号中的slot抛出KeyError"""
+
+        return self.slot_ids[slot]
+
+    def __reduce__(self):
+        # 内存映射不能pickle，重新打开
+        return GoalCorpus, (self.constants,)
+
+    def sample(self):
+        """
+        按sampling随机选择一个goal
+
+        返回:
+            UserGoal
+        """
+
+        if self.sampling == 'uniform':
+            index = random.randrange(self.num_goals)
+        elif self.sampling == 'weighted':
+            index = random.randrange(self.num_goals)
+            if random.random() >= self.alias_prob[index]:
+                index = int(self.alias[index])
+        else:
+            stratum = random.randrange(len(self.strata))
+            start, end = self.strata_offsets[stratum], self.strata_offsets[stratum + 1]
+            index = int(self.strata_order[start + random.randrange(end - start)])
+        return self[index]
+
+
+if __name__ == "__main__":
+    # Converts a pickled goal list to a goal file (one json goal per line) and builds its index
+    # 1) In terminal: python goal_corpus.py --input "data/movie_user_goals.pkl" --output "data/movie_user_goals.jsonl"
+    # 2) Set "file_path" under goal_corpus in the constants of train.py/test.py to the output path
+    # Goal files made in other ways (e.g. synthesized goals appended line by line) only need step 2,
+    # the index is (re)built automatically when the file changes
+    from dataset import load_pickle
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--constants_path', dest='constants_path', type=str, default='constants.json')
+    parser.add_argument('--input', dest='input', type=str, default='')
+    parser.add_argument('--output', dest='output', type=str, default='')
+    args = parser.parse_args()
+
+    with open(args.constants_path) as f:
+        constants = json.load(f)
+    corpus_dict = constants['goal_corpus']
+
+    output = args.output or corpus_dict['file_path'] or 'data/movie_user_goals.jsonl'
+    if args.input:
+        print('Wrote {} goals to {}'.format(write_goal_file(load_pickle(args.input), output), output))
+    index_path = build_index(output, corpus_dict['weight_key'], corpus_dict['stratify_key'])
+    print('Built index: {}'.format(index_path))
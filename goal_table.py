@@ -0,0 +1,153 @@
+from dialogue_config import all_slots, usersim_default_key, usersim_required_init_inform_keys
+from utils import convert_list_to_dict
+from types import MappingProxyType
+import random
+
+
+class UserGoal:
+    """
+    预编译的、不可修改的 user goal，由 GoalTable 创建
+
+    slots以及values以编号保存（slot_ids, value_ids，前num_informs个为inform slots，之后为request slots，
+    包括default slot；vocab不给values编号时value_ids为None），同时保存 UserSimulator 每个episode都要用到的结果：
+    inform_slots / request_slots（只读的dict），初始action的inform slots及其候选、request的候选以及初始的rest slots。
+    UserSimulator.reset 只需复制rest_slots，goal本身不会被修改，可以在线程、进程之间共享。
+    """
+
+    __slots__ = ('index', 'slot_ids', 'value_ids', 'num_informs', 'inform_slots', 'request_slots', 'init_informs',
+                 'inform_items', 'request_candidates', 'rest_slots')
+
+    def __init__(self, index, goal, vocab):
+        """
+        参数:
+            index (int): goal 在 GoalTable 中的序号
+            goal (dict): 原来的user goal，包括 'inform_slots' 以及 'request_slots'，不会被修改
+            vocab (GoalVocab): 用于slots以及values的编号，新的slots以及values会加入其中
+        """
+
+        inform_slots = dict(goal['inform_slots'])
+        # default slot总是在request slots的最后（与原来每个episode加入 'UNK' 的结果相同）
+        request_slots = {key: value for key, value in goal['request_slots'].items() if key != usersim_default_key}
+        request_candidates = tuple(request_slots)
+        request_slots[usersim_default_key] = 'UNK'
+        rest_slots = dict(inform_slots)
+        rest_slots.update(request_slots)
+
+        items = list(inform_slots.items()) + list(request_slots.items())
+        set_ = super().__setattr__
+        set_('index', index)
+        set_('slot_ids', tuple(vocab.add_slot(key) for key, _ in items))
+        set_('value_ids', tuple(vocab.add_value(value) for _, value in items)
+             if vocab.values is not None else None)
+        set_('num_informs', len(inform_slots))
+        set_('inform_slots', MappingProxyType(inform_slots))
+        set_('request_slots', MappingProxyType(request_slots))
+        # 初始action中必须包括的inform slots，为空时从inform_items中随机选择一项
+        set_('init_informs', tuple((key, inform_slots[key]) for key in usersim_required_init_inform_keys
+                                   if key in inform_slots))
+        set_('inform_items', tuple(inform_slots.items()))
+        # 初始action中request的候选（不包括default slot），为空时request default slot
+        set_('request_candidates', request_candidates)
+        set_('rest_slots', tuple(rest_slots.items()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserGoal is immutable!')
+
+    def to_dict(self):
+        """转换为原来的user goal格式（不包括default slot），返回新的dict"""
+
+        request_slots = dict(self.request_slots)
+        del request_slots[usersim_default_key]
+        return {'inform_slots': dict(self.inform_slots), 'request_slots': request_slots}
+
+    def __repr__(self):
+        return 'UserGoal({}, inform_slots={}, request_slots={})'.format(self.index, dict(self.inform_slots),
+                                                                       dict(self.request_slots))
+
+
+class GoalVocab:
+    """
+    编译goals时slots以及values的编号
+
+    slots的编号与 all_slots 中的顺序相同（不在 all_slots 中的slot编号在其后），values按出现的顺序编号。
+    """
+
+    def __init__(self, number_values=True):
+        """
+        参数:
+            number_values (bool): 是否给values编号，为False时values以及value_ids为None，
+                                  只有slots的编号（大小只与slot的种类有关）
+        """
+
+        self.slots = list(all_slots)
+        self.slot_ids = convert_list_to_dict(self.slots)
+        self.values = [] if number_values else None
+        self.value_ids = {} if number_values else None
+
+    def add_slot(self, slot):
+        """slot的编号，新的slot加在最后"""
+
+        if slot not in self.slot_ids:
+            self.slot_ids[slot] = len(self.slots)
+            self.slots.append(slot)
+        return self.slot_ids[slot]
+
+    def add_value(self, value):
+        """value的编号，新的value加在最后"""
+
+        if value not in self.value_ids:
+            self.value_ids[value] = len(self.values)
+            self.values.append(value)
+        return self.value_ids[value]
+
+
+class GoalTable:
+    """
+    预编译的user goals，UserSimulator 从中随机选择goal
+
+    slots以及values的编号见 GoalVocab。编译之后不会再改变（包括slots以及values的编号），
+    可以被多个 UserSimulator（例如 VecDialogueEnv 的各个env以及异步的actor线程）共享。
+    """
+
+    def __init__(self, user_goals):
+        """
+        参数:
+            user_goals (list): 用户目的样例（dict），从文件中加载，不会被修改
+        """
+
+        vocab = GoalVocab()
+        self.goals = tuple(UserGoal(i, goal, vocab) for i, goal in enumerate(user_goals))
+        self.slots = tuple(vocab.slots)
+        self.slot_ids = MappingProxyType(vocab.slot_ids)
+        self.values = tuple(vocab.values)
+        self.value_ids = MappingProxyType(vocab.value_ids)
+
+    def __len__(self):
+        return len(self.goals)
+
+    def __getitem__(self, index):
+        return self.goals[index]
+
+    def __reduce__(self):
+        # 只读的dict不能pickle，由原来的格式重新编译
+        return GoalTable, ([goal.to_dict() for goal in self.goals],)
+
+    def slot_id(self, slot):
+        """slot的编号，不在编号中的slot抛出KeyError（不会加入新的slot）"""
+
+        return self.slot_ids[slot]
+
+    def value_id(self, value):
+        """value的编号，不在编号中的value抛出KeyError（不会加入新的value）"""
+
+        return self.value_ids[value]
+
+    def sample(self):
+        """
+        均匀地随机选择一个goal
+
+        返回:
+            UserGoal
+        """
+
+        return random.choice(self.goals)
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+import numpy as np
+import sys
+
+# get() 未命中时的默认返回值，与缓存的None（即没有匹配结果）区分开
+_MISSING = object()
+
+
+class QueryCache:
+    """有大小上限的LRU查询缓存，记录命中、未命中、淘汰次数以及大致的内存占用"""
+
+    def __init__(self, max_size):
+        """
+        参数:
+            max_size (int): 缓存的最大条目数，为0时不缓存任何结果
+        """
+
+        if max_size < 0:
+            raise ValueError('Cache size must be non-negative!')
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_estimate = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        查询缓存，命中时将此条目标记为最近使用；未命中时不会插入任何条目
+
+        参数:
+            key (hashable): 查询的key
+            default: 未命中时的返回值
+
+        返回:
+            缓存的结果，未命中时返回default
+        """
+
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        将结果存入缓存，超过大小上限时淘汰最久未使用的条目
+
+        参数:
+            key (hashable)
+            value: 需要缓存的结果，可以为空结果（negative result）
+        """
+
+        if self.max_size == 0:
+            return
+        old_value = self._data.pop(key, _MISSING)
+        if old_value is not _MISSING:
+            self.bytes_estimate -= _estimate_size(key, old_value)
+        self._data[key] = value
+        self.bytes_estimate += _estimate_size(key, value)
+        while len(self._data) > self.max_size:
+            old_key, old_value = self._data.popitem(last=False)
+            self.bytes_estimate -= _estimate_size(old_key, old_value)
+            self.evictions += 1
+
+    def items(self):
+        """
+        返回缓存中所有的 (key, value)，按从最久未使用到最近使用的顺序排列，不影响统计数据
+
+        返回:
+            list
+        """
+
+        return list(self._data.items())
+
+    def clear(self):
+        """清空缓存，统计数据保留"""
+
+        self._data.clear()
+        self.bytes_estimate = 0
+
+    def stats(self):
+        """
+        返回缓存的统计数据
+
+        返回:
+            dict: size, max_size, hits, misses, evictions, bytes
+        """
+
+        return {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'bytes': self.bytes_estimate}
+
+
+def _estimate_size(key, value):
+    """
+    粗略估计一个缓存条目 (key, value) 所占的字节数
+
+    array只有拥有自己的数据时才计入数据的字节数（sys.getsizeof已包括）；view（例如倒排索引中的条目位置、共用的NO_ROWS）
+    的数据不属于缓存，只计入array对象本身。
+    """
+
+    size = sys.getsizeof(key) + sum(sys.getsizeof(item) for item in key)
+    if isinstance(value, np.ndarray):
+        size += sys.getsizeof(value)
+    elif isinstance(value, dict):
+        size += sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+    else:
+        size += sys.getsizeof(value)
+    return size
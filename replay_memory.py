@@ -0,0 +1,337 @@
+from state_pool import StatePool
+import numpy as np
+import random
+
+
+class ReplayMemory:
+    """
+    预先分配好内存的环形缓冲区，以structure of arrays的形式存储experience
+
+    states以及next_states分别存储在连续的矩阵中，action、reward、done分别存储在向量中，
+    采样时用index array一次性取出整个batch。state以float32存储，与训练时神经网络的输入精度相同；
+    给定 StateCodec 时以其紧凑格式存储，取出时解码为float32。
+    intern_states为True时states以及next_states只存储 StatePool 中的id，相同的state只存储一次。
+    """
+
+    def __init__(self, max_size, state_size, codec=None, intern_states=False):
+        """
+        参数:
+            max_size (int): 最多存储的experience数目，存满后覆盖最早的experience
+            state_size (int): 状态维度
+            codec (StateCodec): 可选，states以及next_states的存储格式
+            intern_states (bool): 是否将states存储在 StatePool 中
+        """
+
+        self.max_size = max_size
+        self.state_size = state_size
+        self.codec = codec
+        self.pool = StatePool(state_size, codec) if intern_states else None
+        self.states = self._allocate_states()
+        self.next_states = self._allocate_states()
+        self.actions = np.zeros(max_size, dtype=np.int64)
+        self.rewards = np.zeros(max_size, dtype=np.float32)
+        self.dones = np.zeros(max_size, dtype=bool)
+        # 下一个experience写入的位置
+        self.index = 0
+        # 已存储的experience数目
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _allocate_states(self):
+        """分配存储max_size个state的空间"""
+
+        if self.pool is not None:
+            # StatePool中的id，-1表示没有state
+            return np.full(self.max_size, -1, dtype=np.int64)
+        if self.codec is None:
+            return np.zeros((self.max_size, self.state_size), dtype=np.float32)
+        return self.codec.allocate(self.max_size)
+
+    def _write_states(self, store, positions, states):
+        """将states（形状为 (len(positions), state size)）写入store的positions位置"""
+
+        if self.pool is not None:
+            # 被覆盖的state的引用计数减1
+            self.pool.release(store[positions])
+            store[positions] = self.pool.add(states)
+        elif self.codec is None:
+            store[positions] = states
+        else:
+            self.codec.write(store, positions, states)
+
+    def _read_states(self, store, indices):
+        """取出store中indices位置的states，float32"""
+
+        if self.pool is not None:
+            return self.pool.get(store[indices])
+        if self.codec is None:
+            return store[indices]
+        return self.codec.read(store, indices)
+
+    def nbytes(self):
+        """存储experience使用的字节数"""
+
+        arrays = [self.actions, self.rewards, self.dones]
+        for store in (self.states, self.next_states):
+            arrays.extend(store if isinstance(store, tuple) else [store])
+        total = sum(array.nbytes for array in arrays)
+        if self.pool is not None:
+            total += self.pool.nbytes()
+        return total
+
+    def add(self, state, action, reward, next_state, done):
+        """
+        将一个experience复制到memory中，存满后覆盖最早的experience
+
+        参数:
+            state (numpy.array) 当前状态
+            action (int) 行为
+            reward (int) 反馈
+            next_state (numpy.array) 下一个状态
+            done (bool) 是否完成对话
+        """
+
+        i = self.index
+        self._write_states(self.states, [i], np.reshape(state, (1, -1)))
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self._write_states(self.next_states, [i], np.reshape(next_state, (1, -1)))
+        self.dones[i] = done
+        self.index = (self.index + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        """
+        将多个experience一次性复制到memory中，与依次调用add的结果相同
+
+        参数:
+            states (numpy.array) 当前状态，形状为 (experience数目, state size)
+            actions (numpy.array) 行为
+            rewards (numpy.array) 反馈
+            next_states (numpy.array) 下一个状态
+            dones (numpy.array) 是否完成对话
+
+        返回:
+            numpy.array: experience写入的位置
+        """
+
+        num = len(actions)
+        # 超过max_size时只有最后max_size个experience会被保留
+        skip = max(num - self.max_size, 0)
+        positions = (self.index + np.arange(skip, num)) % self.max_size
+        self._write_states(self.states, positions, states[skip:])
+        self.actions[positions] = actions[skip:]
+        self.rewards[positions] = rewards[skip:]
+        self._write_states(self.next_states, positions, next_states[skip:])
+        self.dones[positions] = dones[skip:]
+        self.index = (self.index + num) % self.max_size
+        self.size = min(self.size + num, self.max_size)
+        return positions
+
+    def sample(self, batch_size):
+        """
+        随机取batch_size个不重复的experience的位置，与对memory的list调用random.sample取到的样例相同
+
+        参数:
+            batch_size (int)
+
+        返回:
+            numpy.array: experience的位置
+        """
+
+        return np.array(random.sample(range(self.size), batch_size), dtype=np.int64)
+
+    def get(self, indices):
+        """
+        根据位置一次性取出experience
+
+        参数:
+            indices (numpy.array): experience的位置
+
+        返回:
+            numpy.array: states，形状为 (len(indices), state size)
+            numpy.array: actions
+            numpy.array: rewards
+            numpy.array: next_states，形状为 (len(indices), state size)
+            numpy.array: dones
+        """
+
+        return (self._read_states(self.states, indices), self.actions[indices], self.rewards[indices],
+                self._read_states(self.next_states, indices), self.dones[indices])
+
+    def clear(self):
+        """清空 memory，已分配的内存保留"""
+
+        self.index = 0
+        self.size = 0
+        if self.pool is not None:
+            self.pool.clear()
+            self.states.fill(-1)
+            self.next_states.fill(-1)
+
+    def is_full(self):
+        """查看memory是否已满"""
+
+        return self.size == self.max_size
+
+
+class SumTree:
+    """
+    以array存储的sum tree，叶子节点为每个experience的priority，内部节点为子节点之和
+
+    节点从1开始编号，节点i的子节点为2i以及2i+1，叶子节点从capacity开始（capacity为2的幂）。
+    更新以及按前缀和采样的开销都是O(log n)，并且都以numpy对一组位置同时进行。
+    """
+
+    def __init__(self, size):
+        """
+        参数:
+            size (int): 叶子节点数目，即最多存储的experience数目
+        """
+
+        self.capacity = 1
+        while self.capacity < size:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity)
+
+    def total(self):
+        """所有priority之和"""
+
+        return self.tree[1]
+
+    def get(self, indices):
+        """返回indices对应的priority"""
+
+        return self.tree[indices + self.capacity]
+
+    def update(self, indices, priorities):
+        """
+        更新indices对应的priority，并逐层更新所有祖先节点
+
+        参数:
+            indices (numpy.array): experience的位置
+            priorities (numpy.array): 新的priority
+        """
+
+        nodes = np.asarray(indices) + self.capacity
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """
+        对每个value，找到前缀和第一次超过value的叶子节点
+
+        参数:
+            values (numpy.array): [0, total) 之间的值
+
+        返回:
+            numpy.array: experience的位置
+        """
+
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = self.tree[2 * nodes]
+            go_right = values >= left
+            values -= left * go_right
+            nodes = 2 * nodes + go_right
+        return nodes - self.capacity
+
+    def clear(self):
+        """将所有priority设为0"""
+
+        self.tree.fill(0.0)
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    Prioritized experience replay：按 (|TD error| + epsilon) ^ alpha 的比例采样，并返回importance-sampling weights
+
+    新加入的experience的priority为目前最大的priority，保证至少被采样一次。
+    """
+
+    def __init__(self, max_size, state_size, alpha, beta, epsilon, codec=None, intern_states=False):
+        """
+        参数:
+            max_size (int): 最多存储的experience数目
+            state_size (int): 状态维度
+            alpha (float): priority的指数，0时为均匀采样
+            beta (float): importance-sampling weights的指数，1时完全修正采样带来的偏差
+            epsilon (float): 加到|TD error|上的小常数，避免priority为0
+            codec (StateCodec): 可选，states以及next_states的存储格式
+            intern_states (bool): 是否将states存储在 StatePool 中
+        """
+
+        super().__init__(max_size, state_size, codec, intern_states)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.tree = SumTree(max_size)
+        self.max_priority = 1.0
+
+    def add(self, state, action, reward, next_state, done):
+        self.tree.update(np.array([self.index]), np.array([self.max_priority]))
+        super().add(state, action, reward, next_state, done)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        positions = super().add_batch(states, actions, rewards, next_states, dones)
+        if len(positions):
+            self.tree.update(positions, np.full(len(positions), self.max_priority))
+        return positions
+
+    def sample(self, batch_size):
+        """
+        按priority取batch_size个experience的位置，将总和分为batch_size段，每段取一个（stratified sampling）
+
+        参数:
+            batch_size (int)
+
+        返回:
+            numpy.array: experience的位置
+        """
+
+        segment = self.tree.total() / batch_size
+        values = (np.arange(batch_size) + np.random.random_sample(batch_size)) * segment
+        # 浮点误差可能会取到还没有存储experience的位置
+        return np.minimum(self.tree.find(values), self.size - 1)
+
+    def importance_weights(self, indices):
+        """
+        返回indices对应的importance-sampling weights，以其中的最大值归一化
+
+        参数:
+            indices (numpy.array)
+
+        返回:
+            numpy.array
+        """
+
+        probabilities = self.tree.get(indices) / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        return weights / weights.max()
+
+    def update_priorities(self, indices, td_errors):
+        """
+        根据TD error更新priority
+
+        参数:
+            indices (numpy.array): experience的位置
+            td_errors (numpy.array): 对应的TD error
+        """
+
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        # 同一个experience在一个训练周期中可能被采样多次，保留最后一次的TD error
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def clear(self):
+        super().clear()
+        self.tree.clear()
+        self.max_priority = 1.0
@@ -0,0 +1,174 @@
+from vec_env import VecDialogueEnv
+from dqn_policy import DQNPolicy
+import multiprocessing
+import random
+import numpy as np
+
+
+class RolloutWorkers:
+    """
+    在多个进程中同时运行对话，收集experience
+
+    每个worker进程有自己的 VecDialogueEnv（run中的num_envs个对话）、DQNPolicy 以及独立的随机数种子，
+    不依赖Keras。learner每次调用 collect 时把当前的参数权重以及epsilon发给所有worker，
+    worker运行对话后把experience按array一次性发回，由learner添加至 DQNAgent 的 memory。
+    worker中未结束的对话在两次 collect 之间保留。
+    worker进程以spawn方式启动（不fork learner：learner中的Keras/TensorFlow已经初始化了线程，fork之后可能死锁），
+    参数均被pickle后发给worker。
+    设置了db中的cache_file_path时，worker把新的查询缓存条目随experience一起发回，合并到learner的 DBQuery，
+    由learner保存（worker进程退出时不保存，见 DBQuery.detach_cache_file）。
+    """
+
+    def __init__(self, num_workers, constants, user_goals, database, db_dict, db_helper=None):
+        """
+        参数:
+            num_workers (int): worker进程的数目
+            constants (dict): 配置参数
+            user_goals (list): 用户目的样例
+            database (dict): 数据库，为None时worker自己内存映射db_file_paths中的dataset，
+                             或者连接到db中shared_memory_name对应的共享内存
+            db_dict (dict): 每个slot所有可能的values
+            db_helper (DBQuery): 可选，learner的 DBQuery，worker的查询缓存条目合并到其中
+        """
+
+        if num_workers < 1:
+            raise ValueError('Number of workers must be at least 1!')
+
+        self.num_workers = num_workers
+        self.db_helper = db_helper
+        context = multiprocessing.get_context('spawn')
+        self.connections = []
+        self.processes = []
+        for worker_id in range(num_workers):
+            # 由learner的随机数生成器决定每个worker的种子，learner设置种子时整个运行可以复现
+            seed = random.randrange(2 ** 32)
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_main,
+                                      args=(child_conn, seed, constants, user_goals, database, db_dict), daemon=True)
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+    def collect(self, weights, eps, use_rule=False, num_steps=None, num_episodes=None):
+        """
+        所有worker以给定的参数权重运行对话，直到一共运行了num_steps步或者结束了num_episodes个对话
+
+        参数:
+            weights (list): behavior model的参数权重，use_rule为True时可以为None
+            eps (float): epsilon
+            use_rule (bool): 指明是否使用 rule-based policy
+            num_steps (int): 所有worker一共运行的对话轮次数目（每个对话一轮为一步）
+            num_episodes (int): 所有worker一共需要结束的对话数目
+
+        返回:
+            tuple: (states, actions, rewards, next_states, dones)，所有worker的experience
+            list: 结束的对话是否成功，长度为num_episodes（只给定num_steps时为所有结束的对话）
+            float: 所有experience的reward之和
+        """
+
+        assert num_steps is not None or num_episodes is not None
+        for i, conn in enumerate(self.connections):
+            conn.send(('collect', (weights, eps, use_rule, _split(num_steps, self.num_workers, i),
+                                   _split(num_episodes, self.num_workers, i))))
+        results = [conn.recv() for conn in self.connections]
+
+        experiences = tuple(np.concatenate(arrays) for arrays in zip(*(result[0] for result in results)))
+        successes = [success for result in results for success in result[1]]
+        reward_total = sum(result[2] for result in results)
+        if self.db_helper is not None:
+            for result in results:
+                if result[3] is not None:
+                    self.db_helper.merge_cache_entries(result[3])
+        return experiences, successes, reward_total
+
+    def close(self):
+        """结束所有worker进程"""
+
+        for conn in self.connections:
+            conn.send(('close', None))
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+def _split(total, num_workers, i):
+    """将total平均分给num_workers个worker，返回第i个worker的份额，total为None时返回None"""
+
+    if total is None:
+        return None
+    return total // num_workers + (1 if i < total % num_workers else 0)
+
+
+def _worker_main(conn, seed, constants, user_goals, database, db_dict):
+    """
+    worker进程：等待learner的命令，运行对话并发回experience
+
+    参数:
+        conn (multiprocessing.connection.Connection): 与learner通信
+        seed (int): 随机数种子
+        constants (dict): 配置参数
+        user_goals (list): 用户目的样例
+        database (dict): 数据库，为None时内存映射编译后的数据文件或者连接到共享内存
+        db_dict (dict): 每个slot所有可能的values
+    """
+
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+
+    db_helper = None
+    if database is None and constants['db_file_paths']['dataset']:
+        from dataset import Dataset
+        db_helper = Dataset(constants['db_file_paths']['dataset'], constants).db_helper
+        database = db_helper.database
+    elif database is None:
+        from shared_db import attach_db_query
+        db_helper = attach_db_query(constants['db']['shared_memory_name'], constants)
+        database = db_helper.database
+
+    env = VecDialogueEnv(constants['run']['num_envs'], user_goals, constants, database, db_dict, db_helper=db_helper)
+    # spawn的worker退出时会运行atexit，查询缓存只由learner保存
+    env.db_helper.detach_cache_file()
+    # 已经发给learner的查询缓存条目的key
+    sent_cache_keys = {'db': set(), 'db_slot': set()}
+    policy = DQNPolicy(env.get_state_size(), constants)
+    states = env.reset()
+
+    while True:
+        command, args = conn.recv()
+        if command == 'close':
+            break
+        weights, eps, use_rule, num_steps, num_episodes = args
+        policy.set_weights(weights)
+        policy.eps = eps
+
+        batches = []
+        successes = []
+        reward_total = 0.0
+        steps = 0
+        while (num_steps is None or steps < num_steps) and (num_episodes is None or len(successes) < num_episodes):
+            actions = policy.get_actions(states, use_rule=use_rule, rule_steps=env.rule_steps)
+            next_states, rewards, dones, step_successes = env.step(actions)
+            batches.append((states, actions, rewards, next_states, dones))
+            reward_total += float(rewards.sum())
+            successes.extend(bool(success) for success in step_successes[dones])
+            steps += env.num_envs
+            states = env.states
+        # 同一步中可能结束多个对话，只报告需要的数目
+        if num_episodes is not None:
+            successes = successes[:num_episodes]
+
+        if batches:
+            experiences = tuple(np.concatenate(arrays) for arrays in zip(*batches))
+        else:
+            experiences = (np.zeros((0, env.state_size), dtype=np.float32), np.zeros(0, dtype=np.int64),
+                           np.zeros(0, dtype=np.float32), np.zeros((0, env.state_size), dtype=np.float32),
+                           np.zeros(0, dtype=bool))
+        cache_entries = None
+        if env.db_helper.cache_file_path:
+            cache_entries = env.db_helper.cache_entries(skip=sent_cache_keys)
+        conn.send((experiences, successes, reward_total, cache_entries))
+
+    conn.close()
@@ -0,0 +1,148 @@
+from dialogue_config import all_intents
+from utils import convert_list_to_dict
+
+# intent 到 intent id 的映射，与 StateTracker 中 one-hot 向量的顺序相同
+intent_ids = convert_list_to_dict(all_intents)
+
+# inform_slots 以及 request_slots 被其他frame共享时的标志位
+_SHARED_INFORM = 1
+_SHARED_REQUEST = 2
+
+
+class SemanticFrame:
+    """
+    user 以及 agent 的 action（semantic frame），在 UserSimulator, ErrorModelController 以及 StateTracker 之间传递
+
+    使用__slots__，intent以id保存。copy() 不复制 inform_slots 以及 request_slots，而是与原frame共享（copy-on-write），
+    需要修改时通过 mutable_inform_slots() / mutable_request_slots() 取得属于自己的dict。
+    直接替换 inform_slots 或 request_slots 属性总是安全的。
+
+    为了与原来的dict格式兼容，也支持 frame['intent'], frame['inform_slots'] 等读写方式，并可以与dict互相转换。
+    """
+
+    __slots__ = ('intent_id', 'inform_slots', 'request_slots', 'round', 'speaker', '_shared')
+
+    def __init__(self, intent, inform_slots=None, request_slots=None, round=None, speaker=None):
+        """
+        参数:
+            intent (string): 必须在 all_intents 中
+            inform_slots (dict): 为None时为空dict
+            request_slots (dict): 为None时为空dict
+            round (int): 对话轮次，由 StateTracker 设置
+            speaker (string): 'User' 或者 'Agent'，由 StateTracker 设置
+        """
+
+        self.intent_id = self._intent_id(intent)
+        self.inform_slots = inform_slots if inform_slots is not None else {}
+        self.request_slots = request_slots if request_slots is not None else {}
+        self.round = round
+        self.speaker = speaker
+        self._shared = 0
+
+    @staticmethod
+    def _intent_id(intent):
+        try:
+            return intent_ids[intent]
+        except KeyError:
+            raise ValueError('Intent: {} not in all intents'.format(intent))
+
+    @property
+    def intent(self):
+        return all_intents[self.intent_id]
+
+    @intent.setter
+    def intent(self, intent):
+        self.intent_id = self._intent_id(intent)
+
+    def copy(self):
+        """
+        返回这个frame的副本，inform_slots 以及 request_slots 在被修改之前与原frame共享
+
+        返回:
+            SemanticFrame
+        """
+
+        frame = SemanticFrame.__new__(SemanticFrame)
+        frame.intent_id = self.intent_id
+        frame.inform_slots = self.inform_slots
+        frame.request_slots = self.request_slots
+        frame.round = self.round
+        frame.speaker = self.speaker
+        frame._shared = self._shared = _SHARED_INFORM | _SHARED_REQUEST
+        return frame
+
+    def mutable_inform_slots(self):
+        """返回可以直接修改的 inform_slots，被共享时先复制"""
+
+        if self._shared & _SHARED_INFORM:
+            self.inform_slots = dict(self.inform_slots)
+            self._shared &= ~_SHARED_INFORM
+        return self.inform_slots
+
+    def mutable_request_slots(self):
+        """返回可以直接修改的 request_slots，被共享时先复制"""
+
+        if self._shared & _SHARED_REQUEST:
+            self.request_slots = dict(self.request_slots)
+            self._shared &= ~_SHARED_REQUEST
+        return self.request_slots
+
+    def __getitem__(self, key):
+        if key == 'intent':
+            return self.intent
+        if key in ('inform_slots', 'request_slots', 'round', 'speaker'):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in ('intent', 'inform_slots', 'request_slots', 'round', 'speaker'):
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def update(self, items):
+        """与dict.update相同，用于兼容原来的dict格式"""
+
+        for key, value in items.items():
+            self[key] = value
+
+    def to_dict(self):
+        """
+        转换为原来的dict格式，inform_slots 以及 request_slots 会被复制
+
+        返回:
+            dict
+        """
+
+        frame = {'intent': self.intent, 'inform_slots': dict(self.inform_slots),
+                 'request_slots': dict(self.request_slots)}
+        if self.round is not None:
+            frame['round'] = self.round
+        if self.speaker is not None:
+            frame['speaker'] = self.speaker
+        return frame
+
+    @classmethod
+    def from_dict(cls, frame):
+        """
+        由原来的dict格式创建frame，inform_slots 以及 request_slots 会被复制
+
+        参数:
+            frame (dict)
+
+        返回:
+            SemanticFrame
+        """
+
+        return cls(frame['intent'], dict(frame['inform_slots']), dict(frame['request_slots']), frame.get('round'),
+                   frame.get('speaker'))
+
+    def __eq__(self, other):
+        if isinstance(other, SemanticFrame):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
@@ -0,0 +1,82 @@
+from multiprocessing import shared_memory, resource_tracker
+from db_query import DBQuery
+from db_tables import tables_nbytes, write_tables, read_tables
+from utils import remove_empty_slots, intern_slot_values
+import pickle, argparse, json, os, sys, time
+
+
+class SharedDB:
+    """将DBQuery的db、词表以及索引发布到一块共享内存中，其他进程可以通过名字attach，不需要复制或者unpickle"""
+
+    def __init__(self, db_helper, name=None):
+        """
+        参数:
+            db_helper (DBQuery): 需要发布的DBQuery
+            name (string): 共享内存的名字，为None时自动生成
+        """
+
+        arrays, meta = db_helper.to_tables()
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=tables_nbytes(arrays, meta))
+        write_tables(self.shm.buf, arrays, meta)
+        self.name = self.shm.name
+
+    def close(self):
+        """释放共享内存，已经attach的进程在此之后不能再访问db"""
+
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach_db_query(name, constants):
+    """
+    attach到SharedDB发布的共享内存，返回直接使用共享内存中数据的只读DBQuery
+
+    参数:
+        name (string): 共享内存的名字
+        constants (dict): 配置参数
+
+    返回:
+        DBQuery
+    """
+
+    # 只是attach的进程退出时不应该删除共享内存（resource tracker会在进程退出时unlink它记录的共享内存）
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            # POSIX的resource tracker记录的名字以'/'开头
+            resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    arrays, meta = read_tables(shm.buf)
+    db_helper = DBQuery.from_tables(arrays, meta, constants)
+    # 保留对共享内存的引用，避免被回收
+    db_helper.shared_memory = shm
+    return db_helper
+
+
+if __name__ == "__main__":
+    # Publishes the movie DB into shared memory and keeps it alive until interrupted
+    # 1) In terminal: python shared_db.py --constants_path "constants.json"
+    # 2) Set "shared_memory_name" under db in the constants of train.py/test.py to the printed name
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--constants_path', dest='constants_path', type=str, default='constants.json')
+    parser.add_argument('--name', dest='name', type=str, default='')
+    args = parser.parse_args()
+
+    with open(args.constants_path) as f:
+        constants = json.load(f)
+
+    # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
+    database = pickle.load(open(constants['db_file_paths']['database'], 'rb'), encoding='latin1')
+    remove_empty_slots(database)
+    intern_slot_values(database)
+
+    shared_db = SharedDB(DBQuery(database, constants), name=args.name or constants['db']['shared_memory_name'] or None)
+    print('Published DB in shared memory: {} ({} bytes)'.format(shared_db.name, shared_db.shm.size))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shared_db.close()
@@ -0,0 +1,112 @@
+import argparse, json, subprocess, sys, time
+
+
+def measure(mode, constants_path, weights_path):
+    """
+    在当前（新启动的）进程中测量一次test.py式的启动：导入、加载数据、创建agent以及第一个action的时间，单位为秒
+
+    参数:
+        mode (string): 'inference' 用 DQNPolicy.load_beh_weights（不导入Keras），'keras' 用 DQNAgent
+        constants_path (string): 配置文件
+        weights_path (string): 保存的模型文件，例如 'weights/model.h5'
+
+    返回:
+        dict
+    """
+
+    import resource
+
+    start = time.perf_counter()
+    from user_simulator import UserSimulator
+    from bitmask_user_simulator import BitmaskUserSimulator
+    from error_model_controller import ErrorModelController
+    from state_tracker import StateTracker
+    from dqn_policy import DQNPolicy
+    import pickle
+    if mode == 'keras':
+        from dqn_agent import DQNAgent
+    imported = time.perf_counter()
+
+    with open(constants_path) as f:
+        constants = json.load(f)
+    constants['agent']['load_weights_file_path'] = weights_path
+    file_path_dict = constants['db_file_paths']
+    if file_path_dict['dataset']:
+        from dataset import Dataset
+        dataset = Dataset(file_path_dict['dataset'], constants)
+        db_helper, database = dataset.db_helper, dataset.database
+        db_dict = dataset.db_dict
+    else:
+        from db_query import DBQuery
+        from utils import remove_empty_slots, intern_slot_values
+        database = pickle.load(open(file_path_dict['database'], 'rb'), encoding='latin1')
+        remove_empty_slots(database)
+        intern_slot_values(database)
+        db_helper = DBQuery(database, constants)
+        db_dict = pickle.load(open(file_path_dict['dict'], 'rb'), encoding='latin1')
+    if constants['goal_corpus']['file_path']:
+        from goal_corpus import GoalCorpus
+        user_goals = GoalCorpus(constants)
+    elif file_path_dict['dataset']:
+        user_goals = dataset.user_goals
+    else:
+        user_goals = pickle.load(open(file_path_dict['user_goals'], 'rb'), encoding='latin1')
+    user_class = BitmaskUserSimulator if constants['run']['bitmask_usersim'] else UserSimulator
+    user = user_class(user_goals, constants, database)
+    emc = ErrorModelController(db_dict, constants)
+    state_tracker = StateTracker(database, constants, db_helper=db_helper)
+    data_loaded = time.perf_counter()
+
+    if mode == 'keras':
+        dqn_agent = DQNAgent(state_tracker.get_state_size(), constants)
+    else:
+        dqn_agent = DQNPolicy(state_tracker.get_state_size(), constants)
+        dqn_agent.load_beh_weights(weights_path)
+    agent_built = time.perf_counter()
+
+    user_action = user.reset()
+    emc.infuse_error(user_action)
+    state_tracker.update_state_user(user_action)
+    dqn_agent.get_action(state_tracker.get_state())
+    first_action = time.perf_counter()
+
+    return {'import': imported - start, 'data': data_loaded - imported, 'agent': agent_built - data_loaded,
+            'first_action': first_action - agent_built, 'total': first_action - start,
+            # Linux上ru_maxrss的单位为KB
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+            'keras_imported': 'keras' in sys.modules}
+
+
+if __name__ == "__main__":
+    # Measures the startup of test.py style runs, every run in a fresh process
+    # In terminal: python startup_benchmark.py --modes inference keras --repeats 5
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--constants_path', dest='constants_path', type=str, default='constants.json')
+    parser.add_argument('--weights', dest='weights', type=str, default='weights/model.h5')
+    parser.add_argument('--modes', dest='modes', nargs='+', default=['inference', 'keras'])
+    parser.add_argument('--repeats', dest='repeats', type=int, default=5)
+    parser.add_argument('--measure', dest='measure', type=str, default='')
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.constants_path, args.weights)))
+        sys.exit(0)
+
+    columns = ['import', 'data', 'agent', 'first_action', 'total']
+    print('{:<10} {}  {:>8}  keras'.format('mode', '  '.join('{:>12}'.format(c + ' ms') for c in columns), 'rss MB'))
+    for mode in args.modes:
+        runs = []
+        for _ in range(args.repeats):
+            result = subprocess.run([sys.executable, __file__, '--measure', mode, '--constants_path',
+                                     args.constants_path, '--weights', args.weights],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if result.returncode != 0:
+                print('{:<10} failed: {}'.format(mode, result.stderr.strip().splitlines()[-1]))
+                break
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+        if not runs:
+            continue
+        # 取中位数
+        median = {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in columns + ['max_rss_mb']}
+        print('{:<10} {}  {:>8.1f}  {}'.format(mode, '  '.join('{:>12.1f}'.format(median[c] * 1000) for c in columns),
+                                               median['max_rss_mb'], runs[0]['keras_imported']))
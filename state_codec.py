@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class StateCodec:
+    """
+    state representation 的紧凑存储格式，用于 ReplayMemory
+
+    state中除了real_segments以外的部分都只有0和1，按位打包为uint8（每个state只需要 二值部分维度/8 个字节）。
+    real_segments（对话轮次、db查询结果的数目）的存储方式由real_dtype决定：'float32' 或者 'float16' 直接保存，
+    'counts' 保存 值 * 除数 得到的整数（轮次、匹配的条目数，无符号整数，位数由最大值决定），解码时再除以除数，结果与原来的
+    float32完全相同。解码时直接写入float32的矩阵，用于神经网络的训练。
+    """
+
+    def __init__(self, state_layout, real_segments, real_dtype='float32', scales=None):
+        """
+        参数:
+            state_layout (dict): StateTracker.state_layout，{string: slice}
+            real_segments (tuple): 取值不只是0和1的部分的名字
+            real_dtype (string): real_segments的存储方式，'counts', 'float32' 或者 'float16'
+            scales (dict): real_dtype为'counts'时需要，{segment名字: (除数, 整数的最大值)}，
+                           例如对话轮次为 round_num / 5.，则为 (5., max_round_num)
+        """
+
+        self.state_size = max(segment.stop for segment in state_layout.values())
+        is_real = np.zeros(self.state_size, dtype=bool)
+        for name in real_segments:
+            is_real[state_layout[name]] = True
+        self.binary_columns = np.flatnonzero(~is_real)
+        self.real_columns = np.flatnonzero(is_real)
+        self.num_bytes = (len(self.binary_columns) + 7) // 8
+        self.real_dtype = real_dtype
+        # real部分按组存储，每组为 (列, dtype, 除数)，除数为None时直接保存
+        if real_dtype == 'counts':
+            if scales is None:
+                raise ValueError('Storing the real segments as counts needs their scales!')
+            self.real_groups = [(np.arange(state_layout[name].start, state_layout[name].stop),
+                                 np.min_scalar_type(scales[name][1]), float(scales[name][0]))
+                                for name in real_segments]
+        else:
+            self.real_groups = [(self.real_columns, np.dtype(real_dtype), None)]
+
+    def nbytes(self, num_states):
+        """num_states个state编码之后的字节数"""
+
+        return num_states * (self.num_bytes + sum(len(columns) * dtype.itemsize
+                                                  for columns, dtype, _ in self.real_groups))
+
+    def allocate(self, num_states):
+        """
+        分配可以存储num_states个state的空间
+
+        返回:
+            tuple: (bits, reals...)，bits的形状为 (num_states, 字节数)，每组real部分的形状为 (num_states, 这一组的维度)
+        """
+
+        return (np.zeros((num_states, self.num_bytes), dtype=np.uint8),) + tuple(
+            np.zeros((num_states, len(columns)), dtype=dtype) for columns, dtype, _ in self.real_groups)
+
+    def encode(self, states):
+        """
+        编码states
+
+        参数:
+            states (numpy.array): 形状为 (state数目, state size)
+
+        返回:
+            tuple: (bits, reals...)，与 allocate 的格式相同
+        """
+
+        binary = states[:, self.binary_columns]
+        assert ((binary == 0) | (binary == 1)).all(), 'State has a non binary value outside of the real segments!'
+        parts = [np.packbits(binary.astype(np.uint8), axis=1)]
+        for columns, dtype, divisor in self.real_groups:
+            values = states[:, columns]
+            if divisor is None:
+                parts.append(values.astype(dtype))
+                continue
+            counts = np.rint(values.astype(np.float64) * divisor)
+            assert (counts >= 0).all() and (counts <= np.iinfo(dtype).max).all() and \
+                ((counts / divisor).astype(np.float32) == values.astype(np.float32)).all(), \
+                'State has a real value that is not a count / {}!'.format(divisor)
+            parts.append(counts.astype(dtype))
+        return tuple(parts)
+
+    def decode(self, bits, *reals):
+        """
+        解码 encode 的结果
+
+        参数:
+            bits (numpy.array)
+            reals (numpy.array): 每组real部分
+
+        返回:
+            numpy.array: float32，形状为 (state数目, state size)
+        """
+
+        states = np.empty((len(bits), self.state_size), dtype=np.float32)
+        states[:, self.binary_columns] = np.unpackbits(bits, axis=1)[:, :len(self.binary_columns)]
+        for (columns, _, divisor), values in zip(self.real_groups, reals):
+            # 以float64相除，与 StateTracker.get_state 的计算方式相同
+            states[:, columns] = values if divisor is None else values / divisor
+        return states
+
+    def write(self, store, positions, states):
+        """
+        将states编码后写入store的positions位置
+
+        参数:
+            store (tuple): allocate 的结果
+            positions (numpy.array): 写入的位置
+            states (numpy.array): 形状为 (len(positions), state size)
+        """
+
+        for part, values in zip(store, self.encode(states)):
+            part[positions] = values
+
+    def read(self, store, indices):
+        """
+        取出store中indices位置的state并解码
+
+        参数:
+            store (tuple): allocate 的结果
+            indices (numpy.array): 取出的位置
+
+        返回:
+            numpy.array: float32，形状为 (len(indices), state size)
+        """
+
+        return self.decode(*(part[indices] for part in store))
@@ -0,0 +1,147 @@
+import sys
+import numpy as np
+
+
+class StatePool:
+    """
+    以内容寻址的state池，相同的state只存储一次，用于 ReplayMemory
+
+    state先编码（给定 StateCodec 时为其紧凑格式，否则为float32），以编码后的字节的hash查找已有的state。
+    每个state有一个id以及引用计数，引用计数为0时空间被回收，id被之后加入的state重用。
+    hash相同但内容不同的state（极少出现）单独存储，不参与查找。
+    """
+
+    def __init__(self, state_size, codec=None, capacity=1024):
+        """
+        参数:
+            state_size (int): 状态维度
+            codec (StateCodec): 可选，state的存储格式
+            capacity (int): 初始容量，存满时加倍
+        """
+
+        self.state_size = state_size
+        self.codec = codec
+        self.capacity = capacity
+        self.store = self._encode(np.zeros((capacity, state_size), dtype=np.float32))
+        self.refcounts = np.zeros(capacity, dtype=np.int64)
+        self.hashes = np.zeros(capacity, dtype=np.int64)
+        # {hash: id}
+        self.ids = {}
+        # 被回收的id
+        self.free_ids = []
+        # 从未使用过的最小id
+        self.next_id = 0
+
+    def __len__(self):
+        """存储的不同state的数目"""
+
+        return self.next_id - len(self.free_ids)
+
+    def _encode(self, states):
+        """编码states，返回array组成的tuple，每个array的第i行对应第i个state"""
+
+        if self.codec is None:
+            return (states.astype(np.float32),)
+        return self.codec.encode(states)
+
+    def add(self, states):
+        """
+        加入states，已经存在的state只增加引用计数
+
+        参数:
+            states (numpy.array): 形状为 (state数目, state size)
+
+        返回:
+            numpy.array: 每个state的id
+        """
+
+        parts = self._encode(np.asarray(states).reshape(-1, self.state_size))
+        ids = np.empty(len(parts[0]), dtype=np.int64)
+        for i in range(len(ids)):
+            row = [part[i] for part in parts]
+            data = self._row_bytes(row)
+            key = hash(data)
+            state_id = self.ids.get(key)
+            if state_id is None or self._row_bytes([part[state_id] for part in self.store]) != data:
+                state_id = self._new_id()
+                for part, value in zip(self.store, row):
+                    part[state_id] = value
+                self.hashes[state_id] = key
+                # hash冲突时保留原来的state
+                self.ids.setdefault(key, state_id)
+            self.refcounts[state_id] += 1
+            ids[i] = state_id
+        return ids
+
+    @staticmethod
+    def _row_bytes(row):
+        """一个编码后的state的所有字节"""
+
+        return b''.join(value.tobytes() for value in row)
+
+    def _new_id(self):
+        """返回一个未使用的id，没有时扩大容量"""
+
+        if self.free_ids:
+            return self.free_ids.pop()
+        if self.next_id == self.capacity:
+            self._grow()
+        state_id = self.next_id
+        self.next_id += 1
+        return state_id
+
+    def _grow(self):
+        """容量加倍"""
+
+        self.store = tuple(np.concatenate([part, np.zeros_like(part)]) for part in self.store)
+        self.refcounts = np.concatenate([self.refcounts, np.zeros_like(self.refcounts)])
+        self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+        self.capacity *= 2
+
+    def release(self, ids):
+        """
+        减少ids对应的state的引用计数，为0时回收
+
+        参数:
+            ids (numpy.array): state的id，小于0的id被忽略
+        """
+
+        for state_id in ids:
+            if state_id < 0:
+                continue
+            self.refcounts[state_id] -= 1
+            if self.refcounts[state_id] == 0:
+                key = int(self.hashes[state_id])
+                if self.ids.get(key) == state_id:
+                    del self.ids[key]
+                self.free_ids.append(int(state_id))
+
+    def get(self, ids):
+        """
+        取出ids对应的states
+
+        参数:
+            ids (numpy.array)
+
+        返回:
+            numpy.array: float32，形状为 (len(ids), state size)
+        """
+
+        parts = [part[ids] for part in self.store]
+        if self.codec is None:
+            return parts[0]
+        return self.codec.decode(*parts)
+
+    def clear(self):
+        """清空，已分配的空间保留"""
+
+        self.refcounts.fill(0)
+        self.ids.clear()
+        self.free_ids = []
+        self.next_id = 0
+
+    def nbytes(self):
+        """使用的字节数（包括查找用的dict）"""
+
+        arrays = list(self.store) + [self.refcounts, self.hashes]
+        return sum(array.nbytes for array in arrays) + sys.getsizeof(self.ids)
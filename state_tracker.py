@@ -1,14 +1,14 @@
 from db_query import DBQuery
+from state_codec import StateCodec
 import numpy as np
 from utils import convert_list_to_dict
 from dialogue_config import all_intents, all_slots, usersim_default_key
-import copy
 
 
 class StateTracker:
     """追踪对话的状态，为agent提供当前状态的representation以便让其作出合适的action"""
 
-    def __init__(self, database, constants):
+    def __init__(self, database, constants, db_helper=None):
         """
         The constructor of StateTracker.
 
@@ -18,10 +18,12 @@ class StateTracker:
         Parameters:
             database (dict): The database with format dict(long: dict)
             constants (dict): Loaded constants in dict
+            db_helper (DBQuery): Optional, an existing DB query object (e.g. attached to a shared memory DB) to use
+                                 instead of creating one from database
 
         """
         # db查找工具
-        self.db_helper = DBQuery(database)
+        self.db_helper = db_helper if db_helper is not None else DBQuery(database, constants)
         # 整个对话的目标key，默认为'ticket'
         self.match_key = usersim_default_key
         # intents的dict，key为intent,value为序号
@@ -34,6 +36,13 @@ class StateTracker:
         self.num_slots = len(all_slots)
         # 所允许的最长对话回合数，超过此回合则对话失败
         self.max_round_num = constants['run']['max_round_num']
+        # state representation中各部分的位置，{name: slice}
+        self.state_layout = self._build_state_layout()
+        # state representation中取值不只是0和1的部分，其他部分都是binary
+        self.real_segments = ('turn', 'kb_count')
+        # real_segments 为 整数 / 除数：对话轮次为 round_num / 5.，db查询结果为 匹配的条目数 / 100.，{名字: (除数, 整数的最大值)}
+        self.real_segment_scales = {'turn': (5., self.max_round_num),
+                                    'kb_count': (100., len(self.db_helper.row_ids))}
         # 对话状态中的零状态，即什么信息也没有
         self.none_state = np.zeros(self.get_state_size())
         # 初始化StateTracker
@@ -44,27 +53,92 @@ class StateTracker:
 
         return 2 * self.num_intents + 7 * self.num_slots + 3 + self.max_round_num
 
+    def _build_state_layout(self):
+        """
+        计算state representation中各部分的位置，顺序与拼接的顺序相同
+
+        返回:
+            dict: {string: slice}
+        """
+
+        segments = [('user_act', self.num_intents), ('user_inform_slots', self.num_slots),
+                    ('user_request_slots', self.num_slots), ('agent_act', self.num_intents),
+                    ('agent_inform_slots', self.num_slots), ('agent_request_slots', self.num_slots),
+                    ('current_slots', self.num_slots), ('turn', 1), ('turn_onehot', self.max_round_num),
+                    ('kb_binary', self.num_slots + 1), ('kb_count', self.num_slots + 1)]
+        layout = {}
+        offset = 0
+        for name, size in segments:
+            layout[name] = slice(offset, offset + size)
+            offset += size
+        assert offset == self.get_state_size()
+        return layout
+
+    def get_state_codec(self, real_dtype='counts'):
+        """
+        返回state representation的紧凑存储格式，binary部分按位打包
+
+        参数:
+            real_dtype (string): real_segments的存储方式，'counts'（以整数保存，无损）, 'float32' 或者 'float16'
+
+        返回:
+            StateCodec
+        """
+
+        return StateCodec(self.state_layout, self.real_segments, real_dtype, self.real_segment_scales)
+
     def reset(self):
         """重置StateTracker, 需要初始化current_informs, history and round_num."""
 
         self.current_informs = {}
+        # current_informs的items组成的frozenset，只在current_informs改变时重建，用作db查询缓存的key
+        self.current_informs_key = frozenset()
+        # 满足current_informs中所有约束条件的db条目位置，随着inform的增加逐轮缩小
+        self.candidate_rows = self.db_helper.all_rows
         # A list of the dialogues (dicts) by the agent and user so far in the conversation
         self.history = []
         self.round_num = 0
 
+    def _update_inform(self, key, value):
+        """
+        更新current_informs中的一个slot，并相应地更新candidate_rows
+
+        新增一个约束条件时只需要在candidate_rows中进一步筛选；只有已有约束条件的value被改写时才需要重新查询整个db。
+
+        参数:
+            key (string)
+            value (string)
+        """
+
+        old_value = self.current_informs.get(key)
+        if key in self.current_informs and old_value == value:
+            return
+        self.current_informs[key] = value
+        self.current_informs_key = frozenset(self.current_informs.items())
+        if old_value is not None and self.db_helper.is_query_constraint(key, old_value):
+            self.candidate_rows = self.db_helper.get_db_rows(self.current_informs)
+        elif self.db_helper.is_query_constraint(key, value):
+            # 每个新的inform只在这里转换为词表中的编码一次
+            self.candidate_rows = self.db_helper.narrow_rows(self.candidate_rows, key,
+                                                             self.db_helper.encode_value(value))
+
     def print_history(self):
         """查看历史actions"""
 
         for action in self.history:
             print(action)
 
-    def get_state(self, done=False):
+    def get_state(self, done=False, out=None):
         """
         返回当前的state representation, 表现形式为numpy array，包括user, agent对应的intent, inform_slot, request_slot信息，
         当前状态下已满足条件的slots信息，db的查询结果信息，对话轮次信息
 
+        各部分按照state_layout直接写入同一个array，不需要为每一部分单独创建array再拼接。
+
         Parameters:
             done (bool): 表明是否是最后一轮对话，默认为False
+            out (numpy.array): 可选，形状为 (state size,) 的array，state会直接写入其中并返回。
+                               需要保存state的调用者（例如memory）需要自己复制
 
         Returns:
             numpy.array: numpy array，形状为 (state size,)
@@ -73,74 +147,68 @@ class StateTracker:
 
         # 如果为done，则 state 中的值全为0
         if done:
-            return self.none_state
+            if out is None:
+                return self.none_state
+            out.fill(0.0)
+            return out
+        if out is None:
+            state = np.zeros(self.get_state_size())
+        else:
+            state = out
+            state.fill(0.0)
+        layout = self.state_layout
         # 取history中的最后一个值，即当前状态下user最近的一个action
         user_action = self.history[-1]
         # 根据current_informs，从db中查询满足条件的信息
-        db_results_dict = self.db_helper.get_db_results_for_slots(self.current_informs)
+        db_results_dict = self.db_helper.get_db_results_for_slots(self.current_informs, rows=self.candidate_rows,
+                                                                  inform_items=self.current_informs_key)
         # 取history中倒数第二个值，即当前状态下agent最近的一个action，如果history的长度小于等于1，则为None
         last_agent_action = self.history[-2] if len(self.history) > 1 else None
 
-        # 给user intent创建 one-hot 向量
-        user_act_rep = np.zeros((self.num_intents,))
-        user_act_rep[self.intents_dict[user_action['intent']]] = 1.0
-
-        # 给user inform slots 创建向量
-        user_inform_slots_rep = np.zeros((self.num_slots,))
-        for key in user_action['inform_slots'].keys():
-            user_inform_slots_rep[self.slots_dict[key]] = 1.0
-
-        # 给user request slots 创建向量
-        user_request_slots_rep = np.zeros((self.num_slots,))
-        for key in user_action['request_slots'].keys():
-            user_request_slots_rep[self.slots_dict[key]] = 1.0
-
+        # user intent 的 one-hot 向量（frame的intent id与intents_dict的序号相同）
+        state[layout['user_act']][user_action.intent_id] = 1.0
+        # user inform slots 向量
+        self._fill_slots(state[layout['user_inform_slots']], user_action.inform_slots)
+        # user request slots 向量
+        self._fill_slots(state[layout['user_request_slots']], user_action.request_slots)
         # 根据 current_slots 创建已被填充的slots 信息向量
-        current_slots_rep = np.zeros((self.num_slots,))
-        for key in self.current_informs:
-            current_slots_rep[self.slots_dict[key]] = 1.0
-
-        # 给agent intent创建 one-hot 向量
-        agent_act_rep = np.zeros((self.num_intents,))
-        if last_agent_action:
-            agent_act_rep[self.intents_dict[last_agent_action['intent']]] = 1.0
-
-        # 给agent inform slots 创建向量
-        agent_inform_slots_rep = np.zeros((self.num_slots,))
-        if last_agent_action:
-            for key in last_agent_action['inform_slots'].keys():
-                agent_inform_slots_rep[self.slots_dict[key]] = 1.0
+        self._fill_slots(state[layout['current_slots']], self.current_informs)
 
-        # 给agent request slots 创建向量
-        agent_request_slots_rep = np.zeros((self.num_slots,))
         if last_agent_action:
-            for key in last_agent_action['request_slots'].keys():
-                agent_request_slots_rep[self.slots_dict[key]] = 1.0
-
-        # 给当前对话轮次创那one-hot向量
-        turn_rep = np.zeros((1,)) + self.round_num / 5.
-        turn_onehot_rep = np.zeros((self.max_round_num,))
-        turn_onehot_rep[self.round_num - 1] = 1.0
-
-        # 给db的查询结果创建向量 (scaled counts)
-        kb_count_rep = np.zeros((self.num_slots + 1,)) + db_results_dict['matching_all_constraints'] / 100.
-        for key in db_results_dict.keys():
+            # agent intent 的 one-hot 向量
+            state[layout['agent_act']][last_agent_action.intent_id] = 1.0
+            # agent inform slots 向量
+            self._fill_slots(state[layout['agent_inform_slots']], last_agent_action.inform_slots)
+            # agent request slots 向量
+            self._fill_slots(state[layout['agent_request_slots']], last_agent_action.request_slots)
+
+        # 当前对话轮次以及轮次的one-hot向量
+        state[layout['turn']] = self.round_num / 5.
+        state[layout['turn_onehot']][self.round_num - 1] = 1.0
+
+        # db的查询结果向量 (scaled counts 以及 binary)
+        kb_count_rep = state[layout['kb_count']]
+        kb_binary_rep = state[layout['kb_binary']]
+        kb_count_rep.fill(db_results_dict['matching_all_constraints'] / 100.)
+        kb_binary_rep.fill(db_results_dict['matching_all_constraints'] > 0.)
+        for key, count in db_results_dict.items():
             if key in self.slots_dict:
-                kb_count_rep[self.slots_dict[key]] = db_results_dict[key] / 100.
+                kb_count_rep[self.slots_dict[key]] = count / 100.
+                kb_binary_rep[self.slots_dict[key]] = count > 0.
 
-        # 给db的查询结果创建向量 (binary)
-        kb_binary_rep = np.zeros((self.num_slots + 1,)) + np.sum(db_results_dict['matching_all_constraints'] > 0.)
-        for key in db_results_dict.keys():
-            if key in self.slots_dict:
-                kb_binary_rep[self.slots_dict[key]] = np.sum(db_results_dict[key] > 0.)
+        return state
+
+    def _fill_slots(self, rep, slots):
+        """
+        将slots中出现的slot在rep中对应的位置设为1
 
-        # 将以上所有信息拼接
-        state_representation = np.hstack(
-            [user_act_rep, user_inform_slots_rep, user_request_slots_rep, agent_act_rep, agent_inform_slots_rep,
-             agent_request_slots_rep, current_slots_rep, turn_rep, turn_onehot_rep, kb_binary_rep,
-             kb_count_rep]).flatten()
+        参数:
+            rep (numpy.array): state representation 中的一部分（view）
+            slots (dict): 以slot为key的dict
+        """
 
-        return state_representation
+        for key in slots:
+            rep[self.slots_dict[key]] = 1.0
 
     def update_state_agent(self, agent_action):
         """
@@ -151,37 +219,43 @@ class StateTracker:
         根据agent action更新对话历史(history)
 
         参数:
-            agent_action (dict): The agent action of format dict('intent': string, 'inform_slots': dict,
-                                 'request_slots': dict) and changed to dict('intent': '', 'inform_slots': {},
-                                 'request_slots': {}, 'round': int, 'speaker': 'Agent')
+            agent_action (SemanticFrame): The agent action with intent, inform_slots and request_slots, round and
+                                          speaker are set to the current round and 'Agent'
 
         """
         # 当agent intent 为 inform 时，在current_informs的约束条件下，从db中查找inform_slots所有values对应的条目，
         # 取条目最多的value作为inform_slots的值，并将此信息纪录到current_informs中
-        if agent_action['intent'] == 'inform':
-            assert agent_action['inform_slots']
-            inform_slots = self.db_helper.fill_inform_slot(agent_action['inform_slots'], self.current_informs)
-            agent_action['inform_slots'] = inform_slots
-            assert agent_action['inform_slots']
-            key, value = list(agent_action['inform_slots'].items())[0]  # Only one
+        if agent_action.intent == 'inform':
+            assert agent_action.inform_slots
+            inform_key = next(iter(agent_action.inform_slots))
+            # 如果inform的key不是现有的约束条件，则candidate_rows就是去掉这个key之后的查询结果
+            rows = None
+            if not self.db_helper.is_query_constraint(inform_key, self.current_informs.get(inform_key, 'anything')):
+                rows = self.candidate_rows
+            # fill_inform_slot返回新的dict，直接替换frame的inform_slots
+            agent_action.inform_slots = self.db_helper.fill_inform_slot(agent_action.inform_slots,
+                                                                        self.current_informs, rows=rows)
+            assert agent_action.inform_slots
+            key, value = next(iter(agent_action.inform_slots.items()))  # Only one
             assert key != 'match_found'
             assert value != 'PLACEHOLDER', 'KEY: {}'.format(key)
-            self.current_informs[key] = value
+            self._update_inform(key, value)
         # 如果 agent intent 为 match_found， 在current_informs的约束条件下，从db中查找符合条件的条目
         # 随机取一个条目,将此条目的编号作为current_informs中match_key的value
-        elif agent_action['intent'] == 'match_found':
-            assert not agent_action['inform_slots'], 'Cannot inform and have intent of match found!'
-            db_results = self.db_helper.get_db_results(self.current_informs)
-            if db_results:
+        elif agent_action.intent == 'match_found':
+            assert not agent_action.inform_slots, 'Cannot inform and have intent of match found!'
+            if len(self.candidate_rows):
                 # Arbitrarily pick the first value of the dict
-                key, value = list(db_results.items())[0]
-                agent_action['inform_slots'] = copy.deepcopy(value)
-                agent_action['inform_slots'][self.match_key] = str(key)
+                key, value = self.db_helper.get_row(self.candidate_rows[0])
+                # db中的value都是字符串，浅复制即可
+                agent_action.inform_slots = dict(value)
+                agent_action.inform_slots[self.match_key] = str(key)
             else:
-                agent_action['inform_slots'][self.match_key] = 'no match available'
-            self.current_informs[self.match_key] = agent_action['inform_slots'][self.match_key]
+                agent_action.mutable_inform_slots()[self.match_key] = 'no match available'
+            self._update_inform(self.match_key, agent_action.inform_slots[self.match_key])
         # 更新agent_action中的round_num信息， 并将agent action添加到history
-        agent_action.update({'round': self.round_num, 'speaker': 'Agent'})
+        agent_action.round = self.round_num
+        agent_action.speaker = 'Agent'
         self.history.append(agent_action)
 
     def update_state_user(self, user_action):
@@ -191,16 +265,17 @@ class StateTracker:
         Takes a user action and updates the history. Also augments the user_action param with necessary information.
 
         参数:
-            user_action (dict): The user action of format dict('intent': string, 'inform_slots': dict,
-                                 'request_slots': dict) and changed to dict('intent': '', 'inform_slots': {},
-                                 'request_slots': {}, 'round': int, 'speaker': 'User')
+            user_action (SemanticFrame): The user action with intent, inform_slots and request_slots, round and
+                                         speaker are set to the current round and 'User'
 
         """
         # 将 user action中inform_slots的信息添加到current_informs中
-        for key, value in user_action['inform_slots'].items():
-            self.current_informs[key] = value
+        for key, value in user_action.inform_slots.items():
+            self._update_inform(key, value)
         # 更新agent_action中的round_num信息， 并将agent action添加到history
-        user_action.update({'round': self.round_num, 'speaker': 'User'})
+        user_action.round = self.round_num
+        user_action.speaker = 'User'
+
         self.history.append(user_action)
         # round_num加1
         self.round_num += 1
@@ -1,10 +1,12 @@
 from user_simulator import UserSimulator
+from bitmask_user_simulator import BitmaskUserSimulator
 from error_model_controller import ErrorModelController
-from dqn_agent import DQNAgent
+from dqn_policy import DQNPolicy
 from state_tracker import StateTracker
+from db_query import DBQuery
 import pickle, argparse, json
 from user import User
-from utils import remove_empty_slots
+from utils import remove_empty_slots, intern_slot_values
 
 
 if __name__ == "__main__":
@@ -31,34 +33,75 @@ if __name__ == "__main__":
     DATABASE_FILE_PATH = file_path_dict['database']
     DICT_FILE_PATH = file_path_dict['dict']
     USER_GOALS_FILE_PATH = file_path_dict['user_goals']
+    DATASET_FILE_PATH = file_path_dict['dataset']
+    GOAL_CORPUS_FILE_PATH = constants['goal_corpus']['file_path']
 
     # Load run constants
     run_dict = constants['run']
     USE_USERSIM = run_dict['usersim']
+    BITMASK_USERSIM = run_dict['bitmask_usersim']
     NUM_EP_TEST = run_dict['num_ep_run']
     MAX_ROUND_NUM = run_dict['max_round_num']
 
-    # Load movie DB
-    # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
-    database = pickle.load(open(DATABASE_FILE_PATH, 'rb'), encoding='latin1')
+    # Load agent constants
+    LOAD_WEIGHTS_FILE_PATH = constants['agent']['load_weights_file_path']
 
-    # Clean DB
-    remove_empty_slots(database)
+    # Load db constants
+    SHARED_DB_NAME = constants['db']['shared_memory_name']
 
-    # Load movie dict
-    db_dict = pickle.load(open(DICT_FILE_PATH, 'rb'), encoding='latin1')
-
-    # Load goal file
-    user_goals = pickle.load(open(USER_GOALS_FILE_PATH, 'rb'), encoding='latin1')
+    if DATASET_FILE_PATH:
+        # Memory-map the dataset compiled by 'dataset.py' (cleaned DB with its indexes, movie dict and user goals)
+        from dataset import Dataset
+        dataset = Dataset(DATASET_FILE_PATH, constants)
+        db_helper = dataset.db_helper
+        database = dataset.database
+        db_dict = dataset.db_dict
+    else:
+        if SHARED_DB_NAME:
+            # Attach to the movie DB published in shared memory by 'shared_db.py' instead of loading it
+            from shared_db import attach_db_query
+            db_helper = attach_db_query(SHARED_DB_NAME, constants)
+            database = db_helper.database
+        else:
+            # Load movie DB
+            # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
+            database = pickle.load(open(DATABASE_FILE_PATH, 'rb'), encoding='latin1')
+
+            # Clean DB
+            remove_empty_slots(database)
+            intern_slot_values(database)
+            db_helper = DBQuery(database, constants)
+
+        # Load movie dict
+        db_dict = pickle.load(open(DICT_FILE_PATH, 'rb'), encoding='latin1')
+
+    if GOAL_CORPUS_FILE_PATH:
+        # Sample the goals from the memory-mapped goal file (see 'goal_corpus.py') instead of loading all of them
+        from goal_corpus import GoalCorpus
+        user_goals = GoalCorpus(constants)
+    elif DATASET_FILE_PATH:
+        user_goals = dataset.user_goals
+    else:
+        # Load goal file
+        user_goals = pickle.load(open(USER_GOALS_FILE_PATH, 'rb'), encoding='latin1')
 
     # Init. Objects
-    if USE_USERSIM:
+    if USE_USERSIM and BITMASK_USERSIM:
+        # Same dialogues as UserSimulator (see 'usersim_equivalence.py') with the user sim. state kept as bitmasks
+        user = BitmaskUserSimulator(user_goals, constants, database)
+    elif USE_USERSIM:
         user = UserSimulator(user_goals, constants, database)
     else:
         user = User(constants)
     emc = ErrorModelController(db_dict, constants)
-    state_tracker = StateTracker(database, constants)
-    dqn_agent = DQNAgent(state_tracker.get_state_size(), constants)
+    state_tracker = StateTracker(database, constants, db_helper=db_helper)
+    if LOAD_WEIGHTS_FILE_PATH:
+        # Testing only needs the behavior model's weights, read them into arrays without importing Keras
+        dqn_agent = DQNPolicy(state_tracker.get_state_size(), constants)
+        dqn_agent.load_beh_weights(LOAD_WEIGHTS_FILE_PATH)
+    else:
+        from dqn_agent import DQNAgent
+        dqn_agent = DQNAgent(state_tracker.get_state_size(), constants)
 
 
 def test_run():
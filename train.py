@@ -1,9 +1,13 @@
 from user_simulator import UserSimulator
+from bitmask_user_simulator import BitmaskUserSimulator
 from error_model_controller import ErrorModelController
 from dqn_agent import DQNAgent
 from state_tracker import StateTracker
+from db_query import DBQuery
+from vec_env import VecDialogueEnv
+from async_actor import AsyncActor
 import pickle, argparse, json, math
-from utils import remove_empty_slots
+from utils import remove_empty_slots, intern_slot_values
 from user import User
 
 
@@ -31,37 +35,93 @@ if __name__ == "__main__":
     DATABASE_FILE_PATH = file_path_dict['database']
     DICT_FILE_PATH = file_path_dict['dict']
     USER_GOALS_FILE_PATH = file_path_dict['user_goals']
+    DATASET_FILE_PATH = file_path_dict['dataset']
+    GOAL_CORPUS_FILE_PATH = constants['goal_corpus']['file_path']
 
     # Load run constants
     run_dict = constants['run']
     USE_USERSIM = run_dict['usersim']
+    BITMASK_USERSIM = run_dict['bitmask_usersim']
     WARMUP_MEM = run_dict['warmup_mem']
     NUM_EP_TRAIN = run_dict['num_ep_run']
     TRAIN_FREQ = run_dict['train_freq']
     MAX_ROUND_NUM = run_dict['max_round_num']
     SUCCESS_RATE_THRESHOLD = run_dict['success_rate_threshold']
-
-    # Load movie DB
-    # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
-    database = pickle.load(open(DATABASE_FILE_PATH, 'rb'), encoding='latin1')
-
-    # Clean DB
-    remove_empty_slots(database)
-
-    # Load movie dict
-    db_dict = pickle.load(open(DICT_FILE_PATH, 'rb'), encoding='latin1')
-
-    # Load goal File
-    user_goals = pickle.load(open(USER_GOALS_FILE_PATH, 'rb'), encoding='latin1')
+    NUM_ENVS = run_dict['num_envs']
+    NUM_WORKERS = run_dict['num_workers']
+    ASYNC_TRAINING = run_dict['async_training']
+    ASYNC_QUEUE_SIZE = run_dict['async_queue_size']
+    ASYNC_MAX_STALENESS = run_dict['async_max_staleness']
+
+    # Load agent memory constants
+    COMPACT_MEMORY = constants['agent']['compact_memory']
+    MEMORY_REAL_DTYPE = constants['agent']['memory_real_dtype']
+
+    # Load db constants
+    SHARED_DB_NAME = constants['db']['shared_memory_name']
+
+    if DATASET_FILE_PATH:
+        # Memory-map the dataset compiled by 'dataset.py' (cleaned DB with its indexes, movie dict and user goals)
+        from dataset import Dataset
+        dataset = Dataset(DATASET_FILE_PATH, constants)
+        db_helper = dataset.db_helper
+        database = dataset.database
+        db_dict = dataset.db_dict
+    else:
+        if SHARED_DB_NAME:
+            # Attach to the movie DB published in shared memory by 'shared_db.py' instead of loading it
+            from shared_db import attach_db_query
+            db_helper = attach_db_query(SHARED_DB_NAME, constants)
+            database = db_helper.database
+        else:
+            # Load movie DB
+            # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
+            database = pickle.load(open(DATABASE_FILE_PATH, 'rb'), encoding='latin1')
+
+            # Clean DB
+            remove_empty_slots(database)
+            intern_slot_values(database)
+            db_helper = DBQuery(database, constants)
+
+        # Load movie dict
+        db_dict = pickle.load(open(DICT_FILE_PATH, 'rb'), encoding='latin1')
+
+    if GOAL_CORPUS_FILE_PATH:
+        # Sample the goals from the memory-mapped goal file (see 'goal_corpus.py') instead of loading all of them
+        from goal_corpus import GoalCorpus
+        user_goals = GoalCorpus(constants)
+    elif DATASET_FILE_PATH:
+        user_goals = dataset.user_goals
+    else:
+        # Load goal File
+        user_goals = pickle.load(open(USER_GOALS_FILE_PATH, 'rb'), encoding='latin1')
 
     # Init. Objects
-    if USE_USERSIM:
+    if USE_USERSIM and BITMASK_USERSIM:
+        # Same dialogues as UserSimulator (see 'usersim_equivalence.py') with the user sim. state kept as bitmasks
+        user = BitmaskUserSimulator(user_goals, constants, database)
+    elif USE_USERSIM:
         user = UserSimulator(user_goals, constants, database)
     else:
         user = User(constants)
     emc = ErrorModelController(db_dict, constants)
-    state_tracker = StateTracker(database, constants)
-    dqn_agent = DQNAgent(state_tracker.get_state_size(), constants)
+    state_tracker = StateTracker(database, constants, db_helper=db_helper)
+    # Store the memory's states bit-packed (the real valued parts as integer counts with MEMORY_REAL_DTYPE 'counts', lossless)
+    state_codec = state_tracker.get_state_codec(MEMORY_REAL_DTYPE) if COMPACT_MEMORY else None
+    dqn_agent = DQNAgent(state_tracker.get_state_size(), constants, state_codec=state_codec)
+    # Run NUM_ENVS dialogues side by side (only with the user sim)
+    vec_env = None
+    if USE_USERSIM and (NUM_ENVS > 1 or ASYNC_TRAINING) and NUM_WORKERS == 0:
+        vec_env = VecDialogueEnv(NUM_ENVS, user_goals, constants, database, db_dict, db_helper=db_helper)
+    # Or run them in NUM_WORKERS processes (only with the user sim)
+    rollout_workers = None
+    if USE_USERSIM and NUM_WORKERS > 0:
+        from rollout_workers import RolloutWorkers
+        # The workers memory-map the compiled dataset or attach to the shared memory DB themselves if there is one
+        # Their new DB query cache entries are merged into db_helper, which end_period saves
+        rollout_workers = RolloutWorkers(NUM_WORKERS, constants, user_goals,
+                                         None if DATASET_FILE_PATH or SHARED_DB_NAME else database, db_dict,
+                                         db_helper=db_helper)
 
 
 def run_round(state, warmup=False):
@@ -108,6 +168,48 @@ def warmup_run():
     print('...Warmup Ended')
 
 
+def warmup_run_vec():
+    """
+    Runs the warmup stage with NUM_ENVS dialogues at once through vec_env.
+
+    Same as warmup_run, but the rule-based actions of all dialogues are chosen together and every step adds NUM_ENVS
+    experiences. Loop terminates when at least WARMUP_MEM experiences were added or when the memory buffer is full.
+
+    """
+
+    print('Warmup Started...')
+    total_step = 0
+    states = vec_env.reset()
+    while total_step < WARMUP_MEM and not dqn_agent.is_memory_full():
+        actions = dqn_agent.get_actions(states, use_rule=True, rule_steps=vec_env.rule_steps)
+        next_states, rewards, dones, _ = vec_env.step(actions)
+        dqn_agent.add_experiences(states, actions, rewards, next_states, dones)
+        total_step += NUM_ENVS
+        states = vec_env.states
+
+    print('...Warmup Ended')
+
+
+def warmup_run_workers():
+    """
+    Runs the warmup stage in the rollout worker processes.
+
+    The workers use the rule-based policy and their experiences are added to the agent's memory. Loop terminates when
+    at least WARMUP_MEM experiences were added or when the memory buffer is full.
+
+    """
+
+    print('Warmup Started...')
+    total_step = 0
+    while total_step < WARMUP_MEM and not dqn_agent.is_memory_full():
+        experiences, _, _ = rollout_workers.collect(None, dqn_agent.eps, use_rule=True,
+                                                    num_steps=WARMUP_MEM - total_step)
+        dqn_agent.add_experiences(*experiences)
+        total_step += len(experiences[1])
+
+    print('...Warmup Ended')
+
+
 def train_run():
     """
     Runs the loop that trains the agent.
@@ -136,26 +238,144 @@ def train_run():
 
         # Train
         if episode % TRAIN_FREQ == 0:
-            # Check success rate
-            success_rate = period_success_total / TRAIN_FREQ
-            avg_reward = period_reward_total / TRAIN_FREQ
-            # Flush
-            if success_rate >= success_rate_best and success_rate >= SUCCESS_RATE_THRESHOLD:
-                dqn_agent.empty_memory()
-            # Update current best success rate
-            if success_rate > success_rate_best:
-                print('Episode: {} NEW BEST SUCCESS RATE: {} Avg Reward: {}' .format(episode, success_rate, avg_reward))
-                success_rate_best = success_rate
-                dqn_agent.save_weights()
+            success_rate_best = end_period(episode, period_success_total, period_reward_total, success_rate_best)
             period_success_total = 0
             period_reward_total = 0
-            # Copy
-            dqn_agent.copy()
+    print('...Training Ended')
+
+
+def train_run_vec():
+    """
+    Runs the loop that trains the agent with NUM_ENVS dialogues at once through vec_env.
+
+    Same as train_run, but the actions of all dialogues are chosen with one forward pass of the agent's network.
+    Episodes are counted as they finish; the dialogues still running when the agent is trained continue with the
+    updated network.
+
+    """
+
+    print('Training Started...')
+    episode = 0
+    period_reward_total = 0
+    period_success_total = 0
+    success_rate_best = 0.0
+    states = vec_env.reset()
+    while episode < NUM_EP_TRAIN:
+        actions = dqn_agent.get_actions(states)
+        next_states, rewards, dones, successes = vec_env.step(actions)
+        dqn_agent.add_experiences(states, actions, rewards, next_states, dones)
+        period_reward_total += float(rewards.sum())
+        states = vec_env.states
+
+        for success in successes[dones]:
+            episode += 1
+            period_success_total += int(success)
             # Train
-            dqn_agent.train()
+            if episode % TRAIN_FREQ == 0:
+                success_rate_best = end_period(episode, period_success_total, period_reward_total, success_rate_best)
+                period_success_total = 0
+                period_reward_total = 0
+            if episode == NUM_EP_TRAIN:
+                break
+    print('...Training Ended')
+
+
+def train_run_workers():
+    """
+    Runs the loop that trains the agent with the rollout worker processes generating the episodes.
+
+    Every training period the workers run TRAIN_FREQ episodes with a snapshot of the current behavior model weights,
+    then the agent adds their experiences to its memory and is trained as in train_run.
+
+    """
+
+    print('Training Started...')
+    episode = 0
+    success_rate_best = 0.0
+    while episode < NUM_EP_TRAIN:
+        experiences, successes, period_reward_total = rollout_workers.collect(dqn_agent.beh_weights, dqn_agent.eps,
+                                                                              num_episodes=TRAIN_FREQ)
+        dqn_agent.add_experiences(*experiences)
+        episode += len(successes)
+        success_rate_best = end_period(episode, sum(successes), period_reward_total, success_rate_best)
     print('...Training Ended')
 
 
+def train_run_async():
+    """
+    Runs the loop that trains the agent while an AsyncActor thread keeps generating episodes through vec_env.
+
+    This thread is the learner: it adds the actor's experiences to the agent's memory and ends a training period
+    whenever the actor has finished TRAIN_FREQ more episodes, then publishes the new behavior model weights to the
+    actor. The actor runs at most ASYNC_MAX_STALENESS periods ahead of the learner.
+
+    """
+
+    print('Training Started...')
+    success_rate_best = 0.0
+    period = 0
+    actor = AsyncActor(vec_env, constants, NUM_EP_TRAIN, TRAIN_FREQ, ASYNC_QUEUE_SIZE, ASYNC_MAX_STALENESS)
+    actor.publish_weights(dqn_agent.beh_weights, period)
+    actor.start()
+    try:
+        while True:
+            kind, data = actor.get()
+            if kind == 'experiences':
+                dqn_agent.add_experiences(*data)
+            elif kind == 'period':
+                episode, period_success_total, period_reward_total = data
+                # The actor saves the DB query caches itself
+                success_rate_best = end_period(episode, period_success_total, period_reward_total, success_rate_best,
+                                               save_cache=False)
+                period += 1
+                actor.publish_weights(dqn_agent.beh_weights, period)
+            elif kind == 'error':
+                raise data
+            else:
+                break
+    finally:
+        actor.stop()
+    actor.join()
+    print('...Training Ended')
+
+
+def end_period(episode, period_success_total, period_reward_total, success_rate_best, save_cache=True):
+    """
+    Ends a training period of TRAIN_FREQ episodes: checks the success rate, flushes the memory, saves the weights and
+    the DB query caches, then copies and trains the agent.
+
+    Parameters:
+        episode (int): The number of finished episodes
+        period_success_total (int): The number of successful episodes of the period
+        period_reward_total (float): The total reward of the period
+        success_rate_best (float): The best success rate so far
+        save_cache (bool): Whether to save the DB query caches, False when another thread is using them
+
+    Returns:
+        float: The updated best success rate
+    """
+
+    # Check success rate
+    success_rate = period_success_total / TRAIN_FREQ
+    avg_reward = period_reward_total / TRAIN_FREQ
+    # Flush
+    if success_rate >= success_rate_best and success_rate >= SUCCESS_RATE_THRESHOLD:
+        dqn_agent.empty_memory()
+    # Update current best success rate
+    if success_rate > success_rate_best:
+        print('Episode: {} NEW BEST SUCCESS RATE: {} Avg Reward: {}' .format(episode, success_rate, avg_reward))
+        success_rate_best = success_rate
+        dqn_agent.save_weights()
+    # Save the DB query caches (if a cache file is set)
+    if save_cache:
+        db_helper.save_cache()
+    # Copy
+    dqn_agent.copy()
+    # Train
+    dqn_agent.train()
+    return success_rate_best
+
+
 def episode_reset():
     """
     Resets the episode/conversation in the warmup and training loops.
@@ -176,5 +396,17 @@ def episode_reset():
     dqn_agent.reset()
 
 
-warmup_run()
-train_run()
+if __name__ == "__main__":
+    if rollout_workers is not None:
+        warmup_run_workers()
+        train_run_workers()
+        rollout_workers.close()
+    elif vec_env is not None:
+        warmup_run_vec()
+        if ASYNC_TRAINING:
+            train_run_async()
+        else:
+            train_run_vec()
+    else:
+        warmup_run()
+        train_run()
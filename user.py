@@ -1,5 +1,6 @@
 from dialogue_config import FAIL, SUCCESS, usersim_intents, all_slots
 from utils import reward_function
+from semantic_frame import SemanticFrame
 
 
 class User:
@@ -19,7 +20,7 @@ class User:
         Reset the user.
 
         Returns:
-            dict: The user response
+            SemanticFrame: The user response
         """
 
         return self._return_response()
@@ -35,7 +36,7 @@ class User:
         intents, informs keys and values, and request keys and values cannot contain / , :
 
         Returns:
-            dict: The response of the user
+            SemanticFrame: The response of the user
         """
 
         response = {'intent': '', 'inform_slots': {}, 'request_slots': {}}
@@ -70,7 +71,7 @@ class User:
             if intent_correct and informs_correct and requests_correct:
                 break
 
-        return response
+        return SemanticFrame.from_dict(response)
 
     def _return_success(self):
         """
@@ -90,10 +91,10 @@ class User:
         Return the user's response, reward, done and success.
 
         Parameters:
-            agent_action (dict): The current action of the agent
+            agent_action (SemanticFrame): The current action of the agent
 
         Returns:
-            dict: User response
+            SemanticFrame: User response
             int: Reward
             bool: Done flag
             int: Success: -1, 0 or 1 for loss, neither win nor loss, win
@@ -101,23 +102,22 @@ class User:
 
         # Assertions ----
         # No unk in agent action informs
-        for value in agent_action['inform_slots'].values():
+        for value in agent_action.inform_slots.values():
             assert value != 'UNK'
             assert value != 'PLACEHOLDER'
         # No PLACEHOLDER in agent_action at all
-        for value in agent_action['request_slots'].values():
+        for value in agent_action.request_slots.values():
             assert value != 'PLACEHOLDER'
         # ---------------
 
         print('Agent Action: {}'.format(agent_action))
 
         done = False
-        user_response = {'intent': '', 'request_slots': {}, 'inform_slots': {}}
 
         # First check round num, if equal to max then fail
-        if agent_action['round'] == self.max_round:
+        if agent_action.round == self.max_round:
             success = FAIL
-            user_response['intent'] = 'done'
+            user_response = SemanticFrame('done')
         else:
             user_response = self._return_response()
             success = self._return_success()
@@ -125,8 +125,8 @@ class User:
         if success == FAIL or success == SUCCESS:
             done = True
 
-        assert 'UNK' not in user_response['inform_slots'].values()
-        assert 'PLACEHOLDER' not in user_response['request_slots'].values()
+        assert 'UNK' not in user_response.inform_slots.values()
+        assert 'PLACEHOLDER' not in user_response.request_slots.values()
 
         reward = reward_function(success, self.max_round)
 
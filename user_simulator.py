@@ -1,7 +1,9 @@
 from dialogue_config import usersim_default_key, FAIL, NO_OUTCOME, SUCCESS, usersim_required_init_inform_keys, \
     no_query_keys
 from utils import reward_function
-import random, copy
+from semantic_frame import SemanticFrame
+from goal_table import GoalTable
+import random
 
 
 class UserSimulator:
@@ -10,12 +12,12 @@ class UserSimulator:
     def __init__(self, goal_list, constants, database):
         """
         参数:
-            goal_list (list):用户目的样例，从文件中加载
+            goal_list (list): 用户目的样例，从文件中加载；也可以是 GoalTable（多个user sim.共享）或者 GoalCorpus
             constants (dict): 配置
             database (dict): 数据库，dict形式
         """
 
-        self.goal_list = goal_list
+        self.goal_table = GoalTable(goal_list) if isinstance(goal_list, list) else goal_list
         self.max_round = constants['run']['max_round_num']
         self.default_key = usersim_default_key
         # A list of REQUIRED to be in the first action inform keys
@@ -31,12 +33,10 @@ class UserSimulator:
         重置user sim. 清空state以及初始化action.
 
         返回:
-            dict: initial action
+            SemanticFrame: initial action
         """
-        # 随机选择用户目的 user goal
-        self.goal = random.choice(self.goal_list)
-        # 将default slot 添加到user goal中的request slots中
-        self.goal['request_slots'][self.default_key] = 'UNK'
+        # 随机选择用户目的 user goal（预编译的，只读）
+        self.goal = self.goal_table.sample()
         # 定义状态，state
         self.state = {}
         # 存储所有已被填充的inform slots
@@ -45,10 +45,9 @@ class UserSimulator:
         self.state['inform_slots'] = {}
         # 存储当前未被填充的request slots
         self.state['request_slots'] = {}
-        # Init. all informs and requests in user goal, remove slots as informs made by user or agent
-        self.state['rest_slots'] = {}
-        self.state['rest_slots'].update(self.goal['inform_slots'])
-        self.state['rest_slots'].update(self.goal['request_slots'])
+        # Init. all informs and requests in user goal (incl. the default slot), remove slots as informs made by user
+        # or agent
+        self.state['rest_slots'] = dict(self.goal.rest_slots)
         self.state['intent'] = ''
         # False for failure, true for success, 初始化为FAIL
         self.constraint_check = FAIL
@@ -62,43 +61,33 @@ class UserSimulator:
         The initial action has an intent of request, required init. inform slots and a single request slot.
 
         返回:
-            dict: Initial user response
+            SemanticFrame: Initial user response
         """
 
         # 初始化user的intent为request
         self.state['intent'] = 'request'
         # 如果goal 里存在inform_slots
-        if self.goal['inform_slots']:
-            # 遍历init. informs, 如果存在于 goal inform slots，
+        if self.goal.inform_slots:
+            # init. informs中存在于 goal inform slots的项（预先计算），
             # 添加到state['inform_slots'],state['history_slots']
             # 删除掉state['rest_slots']中对应的item
-            for inform_key in self.init_informs:
-                if inform_key in self.goal['inform_slots']:
-                    self.state['inform_slots'][inform_key] = self.goal['inform_slots'][inform_key]
-                    self.state['rest_slots'].pop(inform_key)
-                    self.state['history_slots'][inform_key] = self.goal['inform_slots'][inform_key]
-            # 如果state['inform_slots']为空，随机从goal['inform_slots']里选一项
-            # 添加到state['inform_slots'],state['history_slots']
-            # 删除掉state['rest_slots']中对应的item
-            if not self.state['inform_slots']:
-                key, value = random.choice(list(self.goal['inform_slots'].items()))
+            # 如果没有，随机从goal的inform slots里选一项
+            init_informs = self.goal.init_informs
+            if not init_informs:
+                init_informs = [random.choice(self.goal.inform_items)]
+            for key, value in init_informs:
                 self.state['inform_slots'][key] = value
                 self.state['rest_slots'].pop(key)
                 self.state['history_slots'][key] = value
 
         # Now add a request, do a random one if something other than def. available
-        self.goal['request_slots'].pop(self.default_key)
-        if self.goal['request_slots']:
-            req_key = random.choice(list(self.goal['request_slots'].keys()))
+        if self.goal.request_candidates:
+            req_key = random.choice(self.goal.request_candidates)
         else:
             req_key = self.default_key
-        self.goal['request_slots'][self.default_key] = 'UNK'
         self.state['request_slots'][req_key] = 'UNK'
 
-        user_response = {}
-        user_response['intent'] = self.state['intent']
-        user_response['request_slots'] = copy.deepcopy(self.state['request_slots'])
-        user_response['inform_slots'] = copy.deepcopy(self.state['inform_slots'])
+        user_response = self._state_to_frame()
 
         return user_response
 
@@ -110,10 +99,10 @@ class UserSimulator:
         Some parts of the rules are stochastic. Check if the agent has succeeded or lost or still going.
 
         Parameters:
-            agent_action (dict): agent 行为
+            agent_action (SemanticFrame): agent 行为
 
         Returns:
-            dict: User sim. response
+            SemanticFrame: User sim. response
             int: Reward
             bool: Done flag
             int: Success: -1, 0 or 1 for loss, neither win nor loss, win
@@ -121,11 +110,11 @@ class UserSimulator:
 
         # 申明
         # agent action中的 inform_slots 的取值不能为 UNK 和PLACEHOLDER
-        for value in agent_action['inform_slots'].values():
+        for value in agent_action.inform_slots.values():
             assert value != 'UNK'
             assert value != 'PLACEHOLDER'
         # agent action中的 request_slots 的取值不能为PLACEHOLDER
-        for value in agent_action['request_slots'].values():
+        for value in agent_action.request_slots.values():
             assert value != 'PLACEHOLDER'
         # ----------------
 
@@ -135,14 +124,14 @@ class UserSimulator:
         done = False
         success = NO_OUTCOME
         # 查看round num, 如果达到max_round，则对话失败
-        if agent_action['round'] == self.max_round:
+        if agent_action.round == self.max_round:
             done = True
             success = FAIL
             self.state['intent'] = 'done'
             self.state['request_slots'].clear()
         # 否则，根据不同的agent intent来作答
         else:
-            agent_intent = agent_action['intent']
+            agent_intent = agent_action.intent
             if agent_intent == 'request':
                 self._response_to_request(agent_action)
             elif agent_intent == 'inform':
@@ -171,26 +160,34 @@ class UserSimulator:
         for key in self.state['history_slots']:
             assert key not in self.state['rest_slots']
         # All slots in both rest and hist should contain the slots for goal
-        for inf_key in self.goal['inform_slots']:
+        for inf_key in self.goal.inform_slots:
             assert self.state['history_slots'].get(inf_key, False) or self.state['rest_slots'].get(inf_key, False)
-        for req_key in self.goal['request_slots']:
+        for req_key in self.goal.request_slots:
             assert self.state['history_slots'].get(req_key, False) or self.state['rest_slots'].get(req_key,
                                                                                                    False), req_key
         # Anything in the rest should be in the goal
         for key in self.state['rest_slots']:
-            assert self.goal['inform_slots'].get(key, False) or self.goal['request_slots'].get(key, False)
+            assert self.goal.inform_slots.get(key, False) or self.goal.request_slots.get(key, False)
         assert self.state['intent'] != ''
         # -----------------------
 
-        user_response = {}
-        user_response['intent'] = self.state['intent']
-        user_response['request_slots'] = copy.deepcopy(self.state['request_slots'])
-        user_response['inform_slots'] = copy.deepcopy(self.state['inform_slots'])
+        user_response = self._state_to_frame()
 
         reward = reward_function(success, self.max_round)
 
         return user_response, reward, done, True if success is 1 else False
 
+    def _state_to_frame(self):
+        """
+        用当前state生成user response，slots的值都是字符串，浅复制即可与state分离
+
+        Returns:
+            SemanticFrame
+        """
+
+        return SemanticFrame(self.state['intent'], dict(self.state['inform_slots']),
+                             dict(self.state['request_slots']))
+
     def _response_to_request(self, agent_action):
         """
         Augments the state in response to the agent action having an intent of request.
@@ -198,28 +195,28 @@ class UserSimulator:
         There are 4 main cases for responding.
 
         Parameters:
-            agent_action (dict): Intent of request with standard action format (including 'speaker': 'Agent' and
+            agent_action (SemanticFrame): Intent of request with standard action format (including 'speaker': 'Agent' and
                                  'round_num': int)
         """
 
-        agent_request_key = list(agent_action['request_slots'].keys())[0]
+        agent_request_key = list(agent_action.request_slots.keys())[0]
         # First Case: if agent requests for something that is in the user sims goal inform slots, then inform it
-        if agent_request_key in self.goal['inform_slots']:
+        if agent_request_key in self.goal.inform_slots:
             self.state['intent'] = 'inform'
-            self.state['inform_slots'][agent_request_key] = self.goal['inform_slots'][agent_request_key]
+            self.state['inform_slots'][agent_request_key] = self.goal.inform_slots[agent_request_key]
             self.state['request_slots'].clear()
             self.state['rest_slots'].pop(agent_request_key, None)
-            self.state['history_slots'][agent_request_key] = self.goal['inform_slots'][agent_request_key]
+            self.state['history_slots'][agent_request_key] = self.goal.inform_slots[agent_request_key]
         # Second Case: if the agent requests for something in user sims goal request slots and it has already been
         # informed, then inform it
-        elif agent_request_key in self.goal['request_slots'] and agent_request_key in self.state['history_slots']:
+        elif agent_request_key in self.goal.request_slots and agent_request_key in self.state['history_slots']:
             self.state['intent'] = 'inform'
             self.state['inform_slots'][agent_request_key] = self.state['history_slots'][agent_request_key]
             self.state['request_slots'].clear()
             assert agent_request_key not in self.state['rest_slots']
         # Third Case: if the agent requests for something in the user sims goal request slots and it HASN'T been
         # informed, then request it with a random inform
-        elif agent_request_key in self.goal['request_slots'] and agent_request_key in self.state['rest_slots']:
+        elif agent_request_key in self.goal.request_slots and agent_request_key in self.state['rest_slots']:
             self.state['request_slots'].clear()
             self.state['intent'] = 'request'
             self.state['request_slots'][agent_request_key] = 'UNK'
@@ -249,12 +246,12 @@ class UserSimulator:
         and remove the agent inform slots from the rest and request slots.
 
         Parameters:
-            agent_action (dict): Intent of inform with standard action format (including 'speaker': 'Agent' and
+            agent_action (SemanticFrame): Intent of inform with standard action format (including 'speaker': 'Agent' and
                                  'round_num': int)
         """
 
-        agent_inform_key = list(agent_action['inform_slots'].keys())[0]
-        agent_inform_value = agent_action['inform_slots'][agent_inform_key]
+        agent_inform_key = list(agent_action.inform_slots.keys())[0]
+        agent_inform_value = agent_action.inform_slots[agent_inform_key]
 
         assert agent_inform_key != self.default_key
 
@@ -267,11 +264,11 @@ class UserSimulator:
 
         # First Case: If agent informs something that is in goal informs and the value it informed doesnt match,
         # then inform the correct value
-        if agent_inform_value != self.goal['inform_slots'].get(agent_inform_key, agent_inform_value):
+        if agent_inform_value != self.goal.inform_slots.get(agent_inform_key, agent_inform_value):
             self.state['intent'] = 'inform'
-            self.state['inform_slots'][agent_inform_key] = self.goal['inform_slots'][agent_inform_key]
+            self.state['inform_slots'][agent_inform_key] = self.goal.inform_slots[agent_inform_key]
             self.state['request_slots'].clear()
-            self.state['history_slots'][agent_inform_key] = self.goal['inform_slots'][agent_inform_key]
+            self.state['history_slots'][agent_inform_key] = self.goal.inform_slots[agent_inform_key]
         # Second Case: Otherwise pick a random action to take
         else:
             # - If anything in state requests then request it
@@ -306,11 +303,11 @@ class UserSimulator:
         Check if there is a match in the agent action that works with the current goal.
 
         Parameters:
-            agent_action (dict): Intent of match_found with standard action format (including 'speaker': 'Agent' and
+            agent_action (SemanticFrame): Intent of match_found with standard action format (including 'speaker': 'Agent' and
                                  'round_num': int)
         """
 
-        agent_informs = agent_action['inform_slots']
+        agent_informs = agent_action.inform_slots
 
         self.state['intent'] = 'thanks'
         self.constraint_check = SUCCESS
@@ -324,7 +321,7 @@ class UserSimulator:
             self.constraint_check = FAIL
 
         # Check to see if all goal informs are in the agent informs, and that the values match
-        for key, value in self.goal['inform_slots'].items():
+        for key, value in self.goal.inform_slots.items():
             assert value != None
             # For items that cannot be in the queries don't check to see if they are in the agent informs here
             if key in self.no_query:
@@ -360,9 +357,10 @@ class UserSimulator:
         # TEMP: ----
         assert self.state['history_slots'][self.default_key] != 'no match available'
 
-        match = copy.deepcopy(self.database[int(self.state['history_slots'][self.default_key])])
+        # 只读取条目，不需要复制
+        match = self.database[int(self.state['history_slots'][self.default_key])]
 
-        for key, value in self.goal['inform_slots'].items():
+        for key, value in self.goal.inform_slots.items():
             assert value != None
             if key in self.no_query:
                 continue
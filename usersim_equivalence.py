@@ -0,0 +1,151 @@
+from user_simulator import UserSimulator
+from bitmask_user_simulator import BitmaskUserSimulator
+from error_model_controller import ErrorModelController
+from state_tracker import StateTracker
+from action_table import ActionTable
+from db_query import DBQuery
+from goal_table import GoalTable
+from dialogue_config import agent_actions, rule_requests, usersim_required_init_inform_keys
+from utils import remove_empty_slots, intern_slot_values
+import argparse, json, pickle, random, time
+
+
+def _frame_items(frame):
+    """frame的内容，slots保留顺序（ErrorModelController 按顺序使用随机数）"""
+
+    return frame.intent, list(frame.inform_slots.items()), list(frame.request_slots.items())
+
+
+def _run_both(reference, bitmask, method, *args):
+    """
+    以相同的随机数状态分别调用两个user sim.的method，检查两者使用的随机数相同
+
+    返回:
+        tuple: 两者的返回值
+        tuple: 两者用的时间
+    """
+
+    start_state = random.getstate()
+    start = time.perf_counter()
+    reference_result = getattr(reference, method)(*args)
+    reference_time = time.perf_counter() - start
+    end_state = random.getstate()
+
+    random.setstate(start_state)
+    start = time.perf_counter()
+    bitmask_result = getattr(bitmask, method)(*args)
+    bitmask_time = time.perf_counter() - start
+    assert random.getstate() == end_state, 'Different random numbers used in {}!'.format(method)
+    return (reference_result, bitmask_result), (reference_time, bitmask_time)
+
+
+def check_equivalence(constants, database, db_dict, user_goals, num_episodes, seed, random_action_prob=0.3):
+    """
+    在相同的对话中逐步比较 UserSimulator 以及 BitmaskUserSimulator
+
+    agent按 rule_requests 依次request，之后match_found、done（与rule-based policy相同），每一步以random_action_prob的
+    概率改为随机的action，从而覆盖所有的 _response_to_* 的情况。每一步比较user response、reward、done、success、
+    user sim.的state以及使用的随机数。
+
+    参数:
+        constants (dict): 配置参数
+        database (dict): 数据库
+        db_dict (dict): 每个slot所有可能的values
+        user_goals (list): 用户目的样例
+        num_episodes (int): 比较的episode数目
+        seed (int): 随机数种子
+        random_action_prob (float): agent每一步使用随机action的概率
+
+    返回:
+        dict: 统计结果，不一致时抛出AssertionError
+    """
+
+    random.seed(seed)
+    agent_random = random.Random(seed + 1)
+    goal_table = GoalTable(user_goals)
+    reference = UserSimulator(goal_table, constants, database)
+    bitmask = BitmaskUserSimulator(goal_table, constants, database)
+    emc = ErrorModelController(db_dict, constants)
+    state_tracker = StateTracker(database, constants, db_helper=DBQuery(database, constants))
+    action_table = ActionTable(agent_actions)
+    rule_actions = [action_table.lookup('request', request_slot=slot) for slot in rule_requests]
+    rule_actions += [action_table.lookup('match_found'), action_table.lookup('done')]
+
+    stats = {'episodes': 0, 'turns': 0, 'successes': 0, 'reference_time': 0., 'bitmask_time': 0.}
+
+    def compare(step_name, results, times):
+        stats['reference_time'] += times[0]
+        stats['bitmask_time'] += times[1]
+        reference_result, bitmask_result = results
+        if step_name == 'reset':
+            reference_result, bitmask_result = (reference_result,), (bitmask_result,)
+        assert _frame_items(reference_result[0]) == _frame_items(bitmask_result[0]), \
+            'Different responses: {} vs {}'.format(_frame_items(reference_result[0]), _frame_items(bitmask_result[0]))
+        assert reference_result[1:] == bitmask_result[1:], \
+            'Different reward/done/success: {} vs {}'.format(reference_result[1:], bitmask_result[1:])
+        reference_state, bitmask_state = reference.state, bitmask.state
+        for key in ('history_slots', 'request_slots', 'intent'):
+            assert reference_state[key] == bitmask_state[key], '{}: {} vs {}'.format(
+                key, reference_state[key], bitmask_state[key])
+        for key in ('inform_slots', 'rest_slots'):
+            assert list(reference_state[key].items()) == list(bitmask_state[key].items()), '{}: {} vs {}'.format(
+                key, reference_state[key], bitmask_state[key])
+        assert reference.constraint_check == bitmask.constraint_check
+        return results[0]
+
+    for episode in range(num_episodes):
+        try:
+            state_tracker.reset()
+            user_action = compare('reset', *_run_both(reference, bitmask, 'reset'))
+            emc.infuse_error(user_action)
+            state_tracker.update_state_user(user_action)
+            step = 0
+            done = False
+            while not done:
+                if agent_random.random() < random_action_prob:
+                    index = agent_random.randrange(len(action_table))
+                else:
+                    index = rule_actions[min(step, len(rule_actions) - 1)]
+                    step += 1
+                agent_action = action_table.to_action(index)
+                state_tracker.update_state_agent(agent_action)
+                user_action, _, done, success = compare('step', *_run_both(reference, bitmask, 'step', agent_action))
+                stats['turns'] += 1
+                if not done:
+                    emc.infuse_error(user_action)
+                state_tracker.update_state_user(user_action)
+            stats['episodes'] += 1
+            stats['successes'] += success
+        except AssertionError as e:
+            raise AssertionError('Episode {} (seed {}), goal {}: {}'.format(episode, seed, reference.goal, e))
+    return stats
+
+
+if __name__ == "__main__":
+    # Checks that BitmaskUserSimulator behaves exactly like UserSimulator, step by step on the same dialogues
+    # In terminal: python usersim_equivalence.py --episodes 2000 --seed 0
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--constants_path', dest='constants_path', type=str, default='constants.json')
+    parser.add_argument('--episodes', dest='episodes', type=int, default=2000)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.constants_path) as f:
+        constants = json.load(f)
+
+    file_path_dict = constants['db_file_paths']
+    database = pickle.load(open(file_path_dict['database'], 'rb'), encoding='latin1')
+    remove_empty_slots(database)
+    intern_slot_values(database)
+    db_dict = pickle.load(open(file_path_dict['dict'], 'rb'), encoding='latin1')
+    user_goals = pickle.load(open(file_path_dict['user_goals'], 'rb'), encoding='latin1')
+    # Also goals without the required init. informs, their initial inform is picked at random
+    user_goals += [dict(goal, inform_slots={key: value for key, value in goal['inform_slots'].items()
+                                            if key not in usersim_required_init_inform_keys}) for goal in user_goals]
+
+    stats = check_equivalence(constants, database, db_dict, user_goals, args.episodes, args.seed)
+    print('Equivalent: {} episodes, {} turns, {} successes'.format(stats['episodes'], stats['turns'],
+                                                                   stats['successes']))
+    num_calls = stats['episodes'] + stats['turns']
+    print('UserSimulator: {:.1f} us/call, BitmaskUserSimulator: {:.1f} us/call'.format(
+        stats['reference_time'] / num_calls * 1e6, stats['bitmask_time'] / num_calls * 1e6))
@@ -1,4 +1,5 @@
 from dialogue_config import FAIL, SUCCESS
+import sys
 
 
 def convert_list_to_dict(lst):
@@ -31,6 +32,63 @@ def remove_empty_slots(dic):
                 dic[id].pop(key)
 
 
+def normalize_slot_value(value):
+    """
+    Returns the canonical form of a slot value, the form used to match values against the DB.
+
+    Parameters:
+        value (string)
+
+    Returns:
+        string: The lowercased value
+    """
+
+    return sys.intern(str(value).lower())
+
+
+def intern_slot_values(dic):
+    """
+    Interns all slot names and values of the DB in place so that repeated strings are stored only once.
+
+    Parameters:
+        dic (dict)
+    """
+
+    for id in dic.keys():
+        dic[id] = {sys.intern(key): sys.intern(value) if isinstance(value, str) else value
+                   for key, value in dic[id].items()}
+
+
+def build_value_vocab(dic):
+    """
+    Builds the canonical value vocabulary of the DB.
+
+    Every distinct normalized value gets an integer id, in order of first appearance. The returned lookup maps both the
+    normalized values and the original (case-sensitive) DB values to their id, so values taken from the DB never need
+    to be case-folded again.
+
+    Parameters:
+        dic (dict)
+
+    Returns:
+        list: The normalized values, indexed by id
+        dict: dict(string: int) of normalized and original values to id
+    """
+
+    values = []
+    lookup = {}
+    for id in dic.keys():
+        for value in dic[id].values():
+            if value in lookup:
+                continue
+            normalized = normalize_slot_value(value)
+            if normalized not in lookup:
+                lookup[normalized] = len(values)
+                values.append(normalized)
+            lookup[value] = lookup[normalized]
+    return values, lookup
+
+
 def reward_function(success, max_round):
     """
     Return the reward given the success.
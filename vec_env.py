@@ -0,0 +1,118 @@
+from user_simulator import UserSimulator
+from bitmask_user_simulator import BitmaskUserSimulator
+from goal_table import GoalTable
+from error_model_controller import ErrorModelController
+from state_tracker import StateTracker
+from action_table import ActionTable
+from db_query import DBQuery
+from dialogue_config import agent_actions
+import numpy as np
+
+
+class VecDialogueEnv:
+    """
+    同时运行num_envs个相互独立的对话，每个对话有自己的 UserSimulator, ErrorModelController 以及 StateTracker
+
+    所有对话共享同一个 DBQuery（及其查询缓存）以及 GoalTable。reset() 以及 step(actions) 以array的形式返回所有对话的state，
+    agent可以一次前向传播为所有对话选择action。结束的对话在 step 中自动重置。
+    """
+
+    def __init__(self, num_envs, user_goals, constants, database, db_dict, db_helper=None):
+        """
+        参数:
+            num_envs (int): 同时运行的对话数目
+            user_goals (list): 用户目的样例，编译为 GoalTable 后被所有 UserSimulator 共享；也可以是 GoalTable 或者 GoalCorpus
+            constants (dict): 配置参数
+            database (dict): 数据库
+            db_dict (dict): 每个slot所有可能的values，用于 ErrorModelController
+            db_helper (DBQuery): 可选，已经创建好的 DBQuery，为None时根据database创建
+        """
+
+        if num_envs < 1:
+            raise ValueError('Number of environments must be at least 1!')
+        if db_helper is None:
+            db_helper = DBQuery(database, constants)
+
+        self.num_envs = num_envs
+        self.db_helper = db_helper
+        self.goal_table = GoalTable(user_goals) if isinstance(user_goals, list) else user_goals
+        user_class = BitmaskUserSimulator if constants['run']['bitmask_usersim'] else UserSimulator
+        self.users = [user_class(self.goal_table, constants, database) for _ in range(num_envs)]
+        self.emcs = [ErrorModelController(db_dict, constants) for _ in range(num_envs)]
+        self.state_trackers = [StateTracker(database, constants, db_helper=db_helper) for _ in range(num_envs)]
+        self.action_table = ActionTable(agent_actions)
+        self.state_size = self.state_trackers[0].get_state_size()
+
+        # 当前每个对话的state，即agent下一次选择action时的输入
+        self.states = np.zeros((num_envs, self.state_size), dtype=np.float32)
+        # 每个对话中agent已经使用rule-based policy的次数，见 DQNAgent.get_actions
+        self.rule_steps = np.zeros(num_envs, dtype=np.int64)
+
+    def get_state_size(self):
+        """返回 state representation 的维度"""
+
+        return self.state_size
+
+    def reset(self):
+        """
+        重置所有对话
+
+        返回:
+            numpy.array: 所有对话的初始state，形状为 (num_envs, state size)
+        """
+
+        self.states = np.zeros((self.num_envs, self.state_size), dtype=np.float32)
+        for i in range(self.num_envs):
+            self._reset_env(i)
+        return self.states
+
+    def _reset_env(self, i):
+        """重置第i个对话，并将初始state写入self.states[i]"""
+
+        state_tracker = self.state_trackers[i]
+        state_tracker.reset()
+        user_action = self.users[i].reset()
+        self.emcs[i].infuse_error(user_action)
+        state_tracker.update_state_user(user_action)
+        state_tracker.get_state(out=self.states[i])
+        self.rule_steps[i] = 0
+
+    def step(self, actions):
+        """
+        每个对话执行一个agent action，结束的对话会被自动重置
+
+        返回的next_states是执行action之后的state（结束的对话为全0），用于添加experience；
+        agent下一次选择action时应使用self.states，其中结束的对话已经被替换为新对话的初始state。
+        之前返回的array不会被修改。
+
+        参数:
+            actions (numpy.array): 每个对话的action的序号，长度为num_envs
+
+        返回:
+            numpy.array: next_states，形状为 (num_envs, state size)
+            numpy.array: rewards
+            numpy.array: dones
+            numpy.array: successes
+        """
+
+        assert len(actions) == self.num_envs
+        next_states = np.empty((self.num_envs, self.state_size), dtype=np.float32)
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        successes = np.zeros(self.num_envs, dtype=bool)
+
+        for i in range(self.num_envs):
+            state_tracker = self.state_trackers[i]
+            agent_action = self.action_table.to_action(int(actions[i]))
+            state_tracker.update_state_agent(agent_action)
+            user_action, rewards[i], dones[i], successes[i] = self.users[i].step(agent_action)
+            if not dones[i]:
+                self.emcs[i].infuse_error(user_action)
+            state_tracker.update_state_user(user_action)
+            state_tracker.get_state(dones[i], out=next_states[i])
+
+        self.states = next_states.copy()
+        for i in np.flatnonzero(dones):
+            self._reset_env(i)
+
+        return next_states, rewards, dones, successes